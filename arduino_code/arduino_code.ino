@@ -1,7 +1,13 @@
-#define COILS 8
+// Most coils on one controller (the size of the pin tables below).
+// The computer sets how many are used with the COILS command.
+// More coils are added by chaining controllers: HANDOFF_OUT_PIN of one
+// controller is wired to TRIGGER_IN_PIN of the next one
+#define MAX_COILS 8
 #define SEP ','
 #define END '\n'
 
+// How long an armed controller waits for the handoff [us]
+#define ARM_TIMEOUT 2000000UL
 
 
 int all_fire_pins[8] = {25, 29, 33, 37, 41, 45, 49, 53};
@@ -10,18 +16,21 @@ int all_voltage_pins[8] = {A7, A6, A5, A4, A3, A2, A1, A0};
 int all_drain_pins[8] = {24, 28, 32, 36, 40, 44, 48, 52};
 int all_HV_pins[8] = {22, 26, 30, 34, 38, 42, 46, 50};
 int MAIN_HV_PIN = 13;
-int fire_pins[COILS];
-int sensor_pins[COILS];
-int voltage_pins[COILS];
-int drain_pins[COILS];
-int HV_pins[COILS];
+int HANDOFF_OUT_PIN = 11;   // Goes HIGH when the projectile has passed the last sensor
+int TRIGGER_IN_PIN = 12;    // Starts the fire sequence of an armed controller
+int coils = MAX_COILS;
+int fire_pins[MAX_COILS];
+int sensor_pins[MAX_COILS];
+int voltage_pins[MAX_COILS];
+int drain_pins[MAX_COILS];
+int HV_pins[MAX_COILS];
 
 enum CoilgunState { OFFLINE, CHARGE, CHARGE_DONE, COUNTDOWN, FIRE };
 CoilgunState currentState =  OFFLINE;
 
 void setup() {
   // Setup all the pins
-  for(int i=0; i < COILS ; i++) {
+  for(int i=0; i < MAX_COILS ; i++) {
     fire_pins[i] = all_fire_pins[i];
     sensor_pins[i] = all_sensor_pins[i];
     voltage_pins[i] = all_voltage_pins[i];
@@ -39,7 +48,10 @@ void setup() {
 
   }
   pinMode(MAIN_HV_PIN, OUTPUT);
-  SetPins(all_HV_pins, "00000000", 8);
+  pinMode(HANDOFF_OUT_PIN, OUTPUT);
+  digitalWrite(HANDOFF_OUT_PIN, LOW);
+  pinMode(TRIGGER_IN_PIN, INPUT);
+  SetPins(all_HV_pins, "0", 8);
   // Begin serial communication
   Serial.begin(115200);
 
@@ -55,6 +67,12 @@ void loop() {
   if (command == "FIRE") {
     Fire();
   }
+  else if (command == "ARM") {
+    Arm();
+  }
+  else if (command == "COILS") {
+    SetCoils();
+  }
   else if (command == "VOLTAGE") {
     ReadVoltage();
   }
@@ -166,36 +184,67 @@ void OFF() {
   PrintSerial("HV OFF");
 }
 
+void SetCoils() {
+  int requested = ReadSerial().toInt();
+  if (requested >= 1 && requested <= MAX_COILS) {
+    coils = requested;
+  }
+  PrintSerial((String)"COILS SET TO: " + coils);
+}
+
 void Fire() {
+  FireSequence();
+}
+
+void Arm() {
+  // Wait for the controller before this one to hand off the projectile
+  PrintSerial("ARMED");
+  unsigned long armed_at = micros();
+  while (digitalRead(TRIGGER_IN_PIN) == LOW) {
+    if (micros() - armed_at > ARM_TIMEOUT) {
+      // The projectile never arrived. Report 0 for all sensors without firing
+      unsigned long empty[MAX_COILS] = {0};
+      SendData(empty, coils);
+      SendData(empty, coils);
+      return;
+    }
+  }
+  FireSequence();
+}
+
+void FireSequence() {
   currentState = FIRE;
   // Shutdown LED-strip
   ChargeBar(0.0);
-  unsigned long blocking_times[COILS];
-  unsigned long trigger_time[COILS];
+  unsigned long blocking_times[MAX_COILS];
+  unsigned long trigger_time[MAX_COILS];
   unsigned long start_time = micros();
 
   // Fire the coils and read there velocity (blocking time)
-  for (int i = 0; i < COILS; i++) {
+  for (int i = 0; i < coils; i++) {
     digitalWrite(fire_pins[i], HIGH);
     delayMicroseconds(10);
     blocking_times[i] = pulseIn(sensor_pins[i], LOW, 100000);
     trigger_time[i] = micros() - start_time;
   }
+  // Start the next controller. Its trigger times start from here
+  digitalWrite(HANDOFF_OUT_PIN, HIGH);
 
   // Reset all the pins
-  for (int i = 0; i < COILS; i++) {
+  for (int i = 0; i < coils; i++) {
     digitalWrite(fire_pins[i], LOW);
   }
 
-  SendData(blocking_times, COILS);
-  SendData(trigger_time, COILS);
+  SendData(blocking_times, coils);
+  SendData(trigger_time, coils);
+  digitalWrite(HANDOFF_OUT_PIN, LOW);
   currentState = OFFLINE;
 }
 
 void ReadVoltage() {
-  unsigned long voltages[COILS];
+  unsigned long voltages[MAX_COILS];
 
-  for (int i = 0; i < COILS; i++) {
+  for (int i = 0; i < coils; i++) {
     int average_voltage = 0;
     for (int j = 0; j < 4; j++) {
       average_voltage += analogRead(voltage_pins[i]);
@@ -203,37 +252,38 @@ void ReadVoltage() {
     voltages[i] = (unsigned long) (average_voltage / 4);
   }
 
-  SendData(voltages, COILS);
+  SendData(voltages, coils);
 }
 
 void HV() {
-  // Get a string of zeros and ones from the computer
+  // Get a bitmask in hex from the computer (bit i is coil i)
   // Turn on HV for all the coils that has a 1
   String HV_command = ReadSerial();
-  SetPins(HV_pins, HV_command, COILS);
+  SetPins(HV_pins, HV_command, coils);
   PrintSerial("HV pins set to: " + HV_command);
 }
 
 void Drain() {
-  // Get a string of zeros and ones from the computer
+  // Get a bitmask in hex from the computer (bit i is coil i)
   // Drain the all CBs that has a 1
   String drain_command = ReadSerial();
-  SetPins(drain_pins, drain_command, COILS);
+  SetPins(drain_pins, drain_command, coils);
   PrintSerial("Drain pins set to: " + drain_command);
 }
 
 void ReadSensors() {
-  unsigned long states[COILS];
-  for (int i = 0; i < COILS; i++) {
+  unsigned long states[MAX_COILS];
+  for (int i = 0; i < coils; i++) {
     states[i] = digitalRead(sensor_pins[i]);
   }
-  SendData(states, COILS);
+  SendData(states, coils);
 }
 
 void SetPins(int pins[], String pin_states, int nb_pins) {
   if (pin_states != "ABORT") {
+    unsigned long mask = strtoul(pin_states.c_str(), NULL, 16);
     for (int i = 0; i < nb_pins; i++) {
-      digitalWrite(pins[i], pin_states[i] == '1');
+      digitalWrite(pins[i], (mask >> i) & 1UL);
     }
   }
   else {
@@ -0,0 +1,102 @@
+"""
+Benchmark the time series codec on the logged data. Compares the size of the
+text files with the encoded streams and the time to parse the text with the
+time to decode the streams
+"""
+import numpy as np
+import argparse
+import glob
+import time
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from codec import encode_streams, decode_streams
+
+
+def best_of(func, runs: int) -> float:
+	"""Fastest of 'runs' calls [ms]"""
+	times = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return min(times) * 1e3
+
+
+def current_traces(runs: int) -> tuple[int, int, float, float]:
+	"""Current traces are time and current columns with 6 decimals, stored with a scale of 1e6"""
+	text_size = encoded_size = 0
+	parse_ms = decode_ms = 0.0
+	for path in sorted(glob.glob(os.path.join(ROOT, 'data_loggs', 'CurrentCoil1', '*V.txt'))):
+		trace = np.loadtxt(path, delimiter=',')
+		encoded = encode_streams({'time': (trace[:, 0], 1e6), 'current': (trace[:, 1], 1e6)})
+		decoded = decode_streams(encoded)
+		assert np.allclose(decoded['current'], trace[:, 1], rtol=0, atol=5e-7)
+
+		text_size += os.path.getsize(path)
+		encoded_size += len(encoded)
+		parse_ms += best_of(lambda: np.loadtxt(path, delimiter=','), runs)
+		decode_ms += best_of(lambda: decode_streams(encoded), runs)
+	return text_size, encoded_size, parse_ms, decode_ms
+
+
+def shot_logs(runs: int) -> tuple[int, int, float, float]:
+	"""
+	Trigger times in the shot logs are whole microseconds. Only that column is
+	compared since the other columns are derived from the raw readings
+	"""
+	import pandas as pd
+
+	text_size = encoded_size = 0
+	parse_ms = decode_ms = 0.0
+	for path in sorted(glob.glob(os.path.join(ROOT, 'data_loggs', '*', '*.csv'))):
+		column = pd.read_csv(path)['Trigger times [s]']
+		if column.isna().any():
+			continue
+		trigger_times_us = np.rint(column.to_numpy() * 1e6).astype(np.int64)
+		encoded = encode_streams({'trigger_times_us': trigger_times_us})
+		text = '\n'.join(column.astype(str)) + '\n'
+
+		text_size += len(text)
+		encoded_size += len(encoded)
+		parse_ms += best_of(lambda: np.array(text.split(), dtype=np.float64), runs)
+		decode_ms += best_of(lambda: decode_streams(encoded), runs)
+	return text_size, encoded_size, parse_ms, decode_ms
+
+
+def synthetic(runs: int, samples: int = 1_000_000) -> tuple[int, int, float, float]:
+	"""A long 10 bit ADC stream, like a charge curve read as fast as possible"""
+	rng = np.random.default_rng(0)
+	adc = np.clip(np.cumsum(rng.integers(-3, 4, samples)) + 512, 0, 1023)
+	encoded = encode_streams({'adc': adc})
+	text = ','.join(map(str, adc.tolist()))
+	assert np.array_equal(decode_streams(encoded)['adc'], adc)
+	return (
+		len(text), len(encoded),
+		best_of(lambda: np.array(text.split(','), dtype=np.int64), runs),
+		best_of(lambda: decode_streams(encoded), runs)
+	)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--runs', type=int, default=5)
+	args = parser.parse_args()
+
+	cases = [
+		('CurrentCoil1 traces', current_traces),
+		('shot log trigger times', shot_logs),
+		('synthetic 1M ADC samples', synthetic),
+	]
+	print(f"{'':<26} {'text [B]':>10} {'encoded [B]':>12} {'ratio':>7} {'parse [ms]':>11} {'decode [ms]':>12}")
+	for name, case in cases:
+		text_size, encoded_size, parse_ms, decode_ms = case(args.runs)
+		print(f"{name:<26} {text_size:>10} {encoded_size:>12} {text_size / encoded_size:>7.1f} {parse_ms:>11.2f} {decode_ms:>12.2f}")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,122 @@
+"""
+Benchmark the time from a cold interpreter until the worker process has
+connected to the Arduinos and reported READY. Arduino.connect is replaced
+with a FakeSerial, everything else (including the imports in a spawned
+worker) is the real path. Compares eagerly importing pandas/yaml and parsing
+the rig file (the old startup) with the lazy imports and the compiled rig cache
+"""
+import subprocess
+import statistics
+import argparse
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP = """
+import time
+t0 = time.perf_counter()
+{eager}
+import fire
+import sys
+import multiprocessing
+sys.path.insert(0, {stub_dir!r})
+import worker
+import startup_stub
+{start_method}
+# The worker target is pickled by name, so a spawned worker imports the stub too
+worker.run_worker = startup_stub.run_worker
+# Keep a reference to the queue like fire.main does. A spawned worker opens it after start() returns
+log_queue = multiprocessing.Queue()
+client = worker.WorkerClient(log_queue, {rig_file!r})
+client.start()
+ready = time.perf_counter() - t0
+client.stop()
+print(ready)
+"""
+
+EAGER = """
+import pandas, yaml
+with open({rig_file!r}) as rig_file:
+	yaml.safe_load(rig_file)
+"""
+
+# Imported by the worker process. Connects every Arduino to a FakeSerial
+STUB = """
+from worker import run_worker as _run_worker
+import communication
+import config
+
+
+def connect(self):
+	from fake_serial import FakeSerial
+	self.arduino = FakeSerial()
+	return True
+
+
+def run_worker(*args):
+	communication.Arduino.connect = connect
+	config.telemetry_bus_name = "startup_benchmark"
+	_run_worker(*args)
+"""
+
+
+def run(code: str) -> tuple[float, float]:
+	"""Run code in a fresh interpreter. Return (total wall time, time measured inside) in ms"""
+	start = time.perf_counter()
+	result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+	if result.returncode:
+		raise RuntimeError(f"Startup failed:\n{result.stderr}")
+	output = result.stdout
+	return (time.perf_counter() - start) * 1e3, float(output) * 1e3
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--runs', type=int, default=10)
+	parser.add_argument('--rig', default=os.path.join(ROOT, 'coils.yaml'))
+	parser.add_argument('--start-method', choices=['fork', 'spawn', 'forkserver'], help="Start method of the worker (default: the platform's)")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		rig_file = os.path.join(tmp, 'coils.yaml')
+		shutil.copy(args.rig, rig_file)
+		cache_file = rig_file + '.cache'
+		with open(os.path.join(tmp, 'startup_stub.py'), 'w') as stub_file:
+			stub_file.write(STUB)
+		start_method = f"multiprocessing.set_start_method({args.start_method!r})" if args.start_method else ''
+
+		def startup(eager: str) -> str:
+			return STARTUP.format(eager=eager, stub_dir=tmp, start_method=start_method, rig_file=rig_file)
+
+		def clear_cache():
+			if os.path.exists(cache_file):
+				os.remove(cache_file)
+
+		cases = [
+			('eager imports + yaml parse', EAGER.format(rig_file=rig_file), clear_cache),
+			('lazy imports, cold rig cache', '', clear_cache),
+			('lazy imports, warm rig cache', '', lambda: None),
+		]
+
+		# Warm the OS file cache and the rig cache
+		run(startup(''))
+
+		print(f"{'':<30} {'process [ms]':>14} {'to READY [ms]':>14}")
+		for name, eager, prepare in cases:
+			totals = []
+			inside = []
+			for _ in range(args.runs):
+				prepare()
+				total, measured = run(startup(eager))
+				totals.append(total)
+				inside.append(measured)
+			print(f"{name:<30} {statistics.median(totals):>14.1f} {statistics.median(inside):>14.1f}")
+
+
+if __name__ == '__main__':
+	main()
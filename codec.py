@@ -0,0 +1,177 @@
+"""
+Compact encoding of integer time series (ADC samples, microsecond timings).
+Values are delta coded, zigzag mapped so small negative steps stay small and
+stored as LEB128 varints. Encoding and decoding are vectorized with NumPy
+"""
+import numpy as np
+import struct
+
+
+MAGIC = b'CGZ1'
+
+# A uint64 needs at most 10 varint bytes
+MAX_VARINT_BYTES = 10
+
+
+def zigzag_encode(values: np.ndarray) -> np.ndarray:
+	"""Map signed to unsigned integers: 0, -1, 1, -2, 2 ... -> 0, 1, 2, 3, 4 ..."""
+	values = np.asarray(values, dtype=np.int64)
+	return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def zigzag_decode(values: np.ndarray) -> np.ndarray:
+	values = np.asarray(values, dtype=np.uint64)
+	return ((values >> np.uint64(1)) ^ (np.uint64(0) - (values & np.uint64(1)))).view(np.int64)
+
+
+def delta_encode(values: np.ndarray) -> np.ndarray:
+	"""First value followed by the difference between neighbouring values"""
+	values = np.asarray(values, dtype=np.int64)
+	return np.diff(values, prepend=np.int64(0))
+
+
+def delta_decode(deltas: np.ndarray) -> np.ndarray:
+	return np.cumsum(deltas, dtype=np.int64)
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+	"""Encode unsigned integers as LEB128 varints (7 bits per byte, high bit set on all but the last byte)"""
+	values = np.asarray(values, dtype=np.uint64)
+	if len(values) == 0:
+		return b''
+
+	# Number of bytes for each value
+	nbytes = np.ones(len(values), dtype=np.int64)
+	for k in range(1, MAX_VARINT_BYTES):
+		nbytes += (values >> np.uint64(7 * k)) != 0
+	width = int(nbytes.max())
+
+	positions = np.arange(width)
+	shifts = (7 * positions).astype(np.uint64)
+	chunks = ((values[:, None] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+	chunks[positions < (nbytes - 1)[:, None]] |= 0x80
+	return chunks[positions < nbytes[:, None]].tobytes()
+
+
+def varint_decode(data: bytes) -> np.ndarray:
+	"""Decode LEB128 varints to unsigned integers"""
+	encoded = np.frombuffer(data, dtype=np.uint8)
+	if len(encoded) == 0:
+		return np.zeros(0, dtype=np.uint64)
+
+	last = encoded < 0x80
+	if not last[-1]:
+		raise ValueError("Truncated varint data")
+	if last.all():
+		# Only single byte values. Common for slowly changing ADC readings
+		return encoded.astype(np.uint64)
+	starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+
+	# Shift each byte by 7 bits for every byte before it in the same value
+	parts = (encoded & 0x7F).astype(np.uint64)
+	continued = np.zeros(len(encoded), dtype=bool)
+	continued[1:] = ~last[:-1]
+	while continued.any():
+		parts[continued] <<= np.uint64(7)
+		continued[1:] &= continued[:-1].copy()
+		continued[0] = False
+	return np.add.reduceat(parts, starts)
+
+
+def encode_ints(values: np.ndarray) -> bytes:
+	"""Delta + zigzag + varint encode a series of integers"""
+	return varint_encode(zigzag_encode(delta_encode(values)))
+
+
+def decode_ints(data: bytes) -> np.ndarray:
+	return delta_decode(zigzag_decode(varint_decode(data)))
+
+
+def encode_streams(streams: dict) -> bytes:
+	"""
+	Encode named series to one blob. A stream is either an integer array or
+	a (float array, scale) tuple that is stored as round(values * scale)
+	"""
+	out = [MAGIC, varint_encode([len(streams)])]
+	for name, stream in streams.items():
+		if isinstance(stream, tuple):
+			values, scale = stream
+			ints = np.rint(np.asarray(values, dtype=np.float64) * scale).astype(np.int64)
+		else:
+			ints, scale = np.asarray(stream), 0.0
+			if not np.issubdtype(ints.dtype, np.integer):
+				raise TypeError(f"Stream '{name}' is not integer. Give it as (values, scale)")
+		payload = encode_ints(ints.ravel())
+		name_bytes = name.encode('utf-8')
+		out += [
+			varint_encode([len(name_bytes)]), name_bytes,
+			struct.pack('<d', scale),
+			varint_encode([ints.size, len(payload)]), payload
+		]
+	return b''.join(out)
+
+
+def decode_streams(data: bytes) -> dict:
+	"""Decode a blob from encode_streams. Scaled streams are returned as floats"""
+	return _decode_block(data, 0)[0]
+
+
+def decode_stream_blocks(data: bytes) -> list[dict]:
+	"""Decode blobs from encode_streams that were written one after the other"""
+	blocks = []
+	pos = 0
+	while pos < len(data):
+		streams, pos = _decode_block(data, pos)
+		blocks.append(streams)
+	return blocks
+
+
+def write_streams(filename: str, streams: dict):
+	with open(filename, 'wb') as stream_file:
+		stream_file.write(encode_streams(streams))
+
+
+def read_streams(filename: str) -> dict:
+	with open(filename, 'rb') as stream_file:
+		return decode_streams(stream_file.read())
+
+
+def read_stream_blocks(filename: str) -> list[dict]:
+	with open(filename, 'rb') as stream_file:
+		return decode_stream_blocks(stream_file.read())
+
+
+def _decode_block(data: bytes, pos: int) -> tuple[dict, int]:
+	"""Decode one blob starting at pos. Return the streams and the position after it"""
+	if data[pos:pos + 4] != MAGIC:
+		raise ValueError("Not an encoded stream file")
+	pos += 4
+	count, pos = _read_varint(data, pos)
+	streams = {}
+	for _ in range(count):
+		name_length, pos = _read_varint(data, pos)
+		name = data[pos:pos + name_length].decode('utf-8')
+		pos += name_length
+		scale = struct.unpack_from('<d', data, pos)[0]
+		pos += 8
+		size, pos = _read_varint(data, pos)
+		payload_length, pos = _read_varint(data, pos)
+		values = decode_ints(data[pos:pos + payload_length])
+		pos += payload_length
+		if len(values) != size:
+			raise ValueError(f"Stream '{name}' has {len(values)} values but should have {size}")
+		streams[name] = values / scale if scale else values
+	return streams, pos
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+	"""Read a single varint. Return the value and the position after it"""
+	value = 0
+	shift = 0
+	while True:
+		byte = data[pos]
+		pos += 1
+		value |= (byte & 0x7F) << shift
+		if byte < 0x80:
+			return value, pos
+		shift += 7
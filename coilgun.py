@@ -1,8 +1,14 @@
 from communication import Arduino, CommunicationError
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 import numpy as np
 import time
 import logging
 
+if TYPE_CHECKING:
+	# Only imported by the worker, and only when the telemetry bus is enabled
+	from telemetry_bus import TelemetryPublisher
+
 
 class Coil:
 	"""Class for handling a single Coil in a coilgun"""
@@ -14,12 +20,20 @@ class Coil:
 		capacitance: float,			# Total capacitance in the capacitance bank [F]
 		R1: float, 					# First resistance in the voltage divider
 		R2: float, 					# Second resistance in the voltage divider
-		state: bool 				# Is the coil on?
+		state: bool, 				# Is the coil on?
+		windings: int = 0, 			# Number of windings on the coil
+		position: float = 0, 		# Position relative sensor [mm] (end of sensor to start of coil)
+		resistor_tolerance: float = 0.01, 	# Relative tolerance of R1 and R2
+		capacitance_tolerance: float = 0.1 	# Relative tolerance of the capacitance
 	):
 		self.capacitance = capacitance
+		self.windings = windings
+		self.position = position
 
 		self.R1 = R1
 		self.R2 = R2
+		self.resistor_tolerance = resistor_tolerance
+		self.capacitance_tolerance = capacitance_tolerance
 
 		# Is ready
 		self.READY = False
@@ -110,36 +124,60 @@ class Coilgun:
 	def __init__(
 		self, 
 		coils: list[Coil], 
-		arduino: Arduino, 
+		arduino: Arduino | list[Arduino], 
 		projectile_dimeter: float,
 		projectile_mass: float,
-		logger: logging.Logger = None
+		logger: logging.Logger = None,
+		telemetry: 'TelemetryPublisher' = None,
+		controller_coils: list[int] = None
 	):
 		self.coils = coils
-		self.arduino = arduino
+
+		# Chained controllers in the order the projectile passes them.
+		# 'controller_coils' is the number of coils on each controller
+		self.arduinos = [arduino] if isinstance(arduino, Arduino) else list(arduino)
+		self.arduino = self.arduinos[0]
+		if controller_coils is None:
+			if len(self.arduinos) > 1:
+				raise ValueError("'controller_coils' is needed when more than one controller is used")
+			controller_coils = [len(coils)]
+		if len(controller_coils) != len(self.arduinos) or sum(controller_coils) != len(coils):
+			raise ValueError(f"Can't spread {len(coils)} coils over {len(self.arduinos)} controllers as {controller_coils}")
+		self.controller_coils = controller_coils
+		bounds = np.cumsum([0] + controller_coils)
+		# The coils of each controller
+		self.slices = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+		# Talk to all controllers at the same time
+		self._executor = ThreadPoolExecutor(max_workers=len(self.arduinos)) if len(self.arduinos) > 1 else None
+
 		self.projectile_dimeter = projectile_dimeter
 		self.projectile_mass = projectile_mass
+		# Publish voltages and fire results to other processes
+		self.telemetry = telemetry
 
 		# Create a default logger
 		if logger is None:
 			logger = logging.getLogger('Coilgun')
-			# Add console logging to the logger
-			c_handler = logging.StreamHandler()
-			c_handler.setLevel(logging.WARNING)
-			c_format = logging.Formatter('%(name)s : %(levelname)s : %(message)s')
-			c_handler.setFormatter(c_format)
-			logger.addHandler(c_handler)
+			# The logger is shared by all coilguns so only add console logging once
+			if not logger.handlers:
+				c_handler = logging.StreamHandler()
+				c_handler.setLevel(logging.WARNING)
+				c_format = logging.Formatter('%(name)s : %(levelname)s : %(message)s')
+				c_handler.setFormatter(c_format)
+				logger.addHandler(c_handler)
 		self.logger = logger
 
 		# Logging
 		self.logger.debug(f"Coilgun with {len(self)} coils was created")
 
 		# Startup 
+		self.SET_COILS()
 		self.OFF()
 
 	def OFF(self):
 		"""Reset the coilgun"""
-		self.arduino.flush_serial()
+		for arduino in self.arduinos:
+			arduino.flush_serial()
 		self.MAIN_HV_OFF()
 		# Drain and turn off HV to all CBs
 		self.DRAIN_ALL(True)
@@ -155,46 +193,83 @@ class Coilgun:
 		self.DRAIN_ALL(False)
 		self.MAIN_HV_ON()
 		self.HV_ALL(True)
-		self.arduino.send(Arduino.CHARGE)
-		response = self.arduino.read()
-		if not response == Arduino.CHARGE_RESPONSE:
-			self.logger.warning(f"Arduino did not swith to the charge state correctly. Responded with: '{response}")
-			# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
-		else:
-			self.logger.debug(f"Arduino swithed to charge state")
+		for response in self._command(Arduino.CHARGE):
+			if not response == Arduino.CHARGE_RESPONSE:
+				self.logger.warning(f"Arduino did not swith to the charge state correctly. Responded with: '{response}")
+				# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
+			else:
+				self.logger.debug(f"Arduino swithed to charge state")
 		# Logging
 		self.logger.debug("Coilgun was turned on")
 
 	def READ_VOLTAGES(self):
 		"""Read all voltages for all CBs"""
 
-		# Read all voltages with the Arduino
-		pot_values = Coil.read_voltages(arduino=self.arduino)
-		self.logger.debug(f"Voltage values read from the Arduino: {pot_values}")
+		# Read all voltages with the Arduinos
+		pot_values = self._join(self.on_all(lambda i, arduino: Coil.read_voltages(arduino=arduino)))
+		self.logger.debug("Voltage values read from the Arduino: %s", pot_values, extra={'adc': pot_values})
 
 		voltages = [coil.read_voltage(pot_values) for coil in self.coils]
-		self.logger.debug(f"Arduino voltages converted to: {voltages}")
+		self.logger.debug("Arduino voltages converted to: %s", voltages)
+		if self.telemetry is not None:
+			self.telemetry.publish_voltages(voltages)
 
 		return voltages
 
 	def FIRE(self):
 		"""Fire the coilgun"""
 		# Fire coilgun and read sensor blocking time in microseconds
-		self.arduino.send(Arduino.FIRE)
+		responses = self.fire_chain(lambda i, arduino: (arduino.read(), arduino.read()))
 		self.logger.debug(f"Coilgun fired")
-		blocking_times_us = self.arduino.read()
-		trigger_times_us = self.arduino.read()
-		self.logger.debug(f"Sensors were blocked for {blocking_times_us} us")
-		self.logger.debug(f"Sensors blocked at: {trigger_times_us} us")
+		blocking_times_us = self._join([blocking.split(Arduino.SEP) for blocking, _ in responses])
+		trigger_times_us = np.array([int(t_us) for t_us in self._join([trigger.split(Arduino.SEP) for _, trigger in responses])])
+		self.align_trigger_times(trigger_times_us)
+		self.logger.debug("Sensors were blocked for %s us", blocking_times_us)
+		self.logger.debug("Sensors blocked at: %s us", trigger_times_us)
 
 		# Calculate the projectile velocities at the sensors
-		blocking_times = np.array([int(t_us) * 1e-6 for t_us in blocking_times_us.split(Arduino.SEP)])
-		trigger_times = np.array([int(t_us) * 1e-6 for t_us in trigger_times_us.split(Arduino.SEP)])
+		blocking_times = np.array([int(t_us) * 1e-6 for t_us in blocking_times_us])
+		trigger_times = trigger_times_us * 1e-6
 		velocities = self.projectile_dimeter / blocking_times
-		self.logger.debug(f"Calculated velocities for the projectile: {velocities}")
+		self.logger.debug("Calculated velocities for the projectile: %s", velocities)
+		if self.telemetry is not None:
+			self.telemetry.publish_fire(velocities, trigger_times, blocking_times)
 
 		return velocities, trigger_times
 
+	def fire_chain(self, read) -> list:
+		"""
+		Fire all controllers in the order the projectile passes them and return read(index, arduino) for each.
+		The controllers after the first are armed before the first one fires. Each of them starts its
+		sequence when the controller before it raises its handoff line after its last sensor, so a stage
+		is never fired before the projectile reaches it
+		"""
+		for arduino in self.arduinos[1:]:
+			arduino.send(Arduino.ARM)
+			response = arduino.read()
+			if not response == Arduino.ARM_RESPONSE:
+				self.logger.critical(f"Arduino on {arduino.port} was not armed. Responded with: '{response}'")
+				raise CommunicationError(f"Arduino on {arduino.port} was not armed. Responded with: '{response}'")
+		self.arduino.send(Arduino.FIRE)
+		return [read(i, arduino) for i, arduino in enumerate(self.arduinos)]
+
+	def align_trigger_times(self, trigger_times: np.ndarray):
+		"""
+		Each controller measures trigger times from when it was handed the projectile, which is
+		the last trigger time of the controller before it. Shift them in place to the time of the first controller
+		"""
+		for previous, current in zip(self.slices[:-1], self.slices[1:]):
+			trigger_times[current] += trigger_times[previous.stop - 1]
+
+	def SET_COILS(self):
+		"""Tell each controller how many coils it has, so it never fires or waits on unused pins"""
+		responses = self._command(Arduino.COILS, messages=[str(n) for n in self.controller_coils])
+		for response, n in zip(responses, self.controller_coils):
+			if not response == f"{Arduino.COILS_RESPONSE}{n}":
+				self.logger.critical(f"Arduino did not set the number of coils to {n}. Responded with: '{response}'")
+				raise CommunicationError(f"Arduino did not set the number of coils to {n}. Responded with: '{response}'")
+		self.logger.debug("Number of coils set to %s", self.controller_coils)
+
 	def READY_2_FIRE(self):
 		"""Check if the coilgun is ready to fire"""
 		for coil in self.coils:
@@ -204,20 +279,18 @@ class Coilgun:
 
 	def MAIN_HV_ON(self):
 		"""Turn on HIGH VOLTAGE"""
-		self.arduino.send(Arduino.ON)
-		response = self.arduino.read()
-		if not response == Arduino.HV_ON:
-			self.logger.warning(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
-			raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
+		for response in self._command(Arduino.ON):
+			if not response == Arduino.HV_ON:
+				self.logger.warning(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
+				raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
 		self.logger.debug(f"Main HV turned on")
 
 	def MAIN_HV_OFF(self):
 		"""Turn off HIGH VOLTAGE"""
-		self.arduino.send(Arduino.OFF)
-		response = self.arduino.read()
-		if not response == Arduino.HV_OFF:
-			self.logger.critical(f"Arduino did not turn off main HV correctly. Responded with: '{response}'")
-			raise CommunicationError(f"Arduino did not turn off main HV correctly. Responded with: '{response}'")
+		for response in self._command(Arduino.OFF):
+			if not response == Arduino.HV_OFF:
+				self.logger.critical(f"Arduino did not turn off main HV correctly. Responded with: '{response}'")
+				raise CommunicationError(f"Arduino did not turn off main HV correctly. Responded with: '{response}'")
 		self.logger.debug(f"Main HV turned off")
 
 	def DRAIN_CB(self, CBs_to_drain: list[bool]):
@@ -225,17 +298,14 @@ class Coilgun:
 		# This is flipped because the relay is NC
 		# Only 
 		CBs_to_drain = [(not CB) and (coil.ON) for CB, coil in zip(CBs_to_drain, self)]
-		message = self.convert_bool_list_to_Arduino_message(CBs_to_drain)
-		self.logger.debug(f"Draining command: {message}")
+		messages = [self.convert_bool_list_to_Arduino_message(CBs_to_drain[s]) for s in self.slices]
+		self.logger.debug("Draining command: %s", messages)
 
 		# Send command and message
-		self.arduino.send(Arduino.DRAIN)
-		self.arduino.send(message)
-
-		response = self.arduino.read()
-		if not Arduino.DRAIN_RESPONSE in response:
-			self.logger.critical(f"Arduino did not drain CBs correctly. Responded with: '{response}'")
-			raise CommunicationError(f"Arduino did not drain CBs correctly. Responded with: '{response}'")
+		for response in self._command(Arduino.DRAIN, messages):
+			if not Arduino.DRAIN_RESPONSE in response:
+				self.logger.critical(f"Arduino did not drain CBs correctly. Responded with: '{response}'")
+				raise CommunicationError(f"Arduino did not drain CBs correctly. Responded with: '{response}'")
 		self.logger.debug(f"CBs drained")
 
 	def DRAIN_ALL(self, drain: bool = True):
@@ -246,17 +316,14 @@ class Coilgun:
 		"""Turn HV ON/OFF"""
 		# Only allow HV to be turned on for a coil that is ON
 		HV_states = [HV_state and coil.ON for HV_state, coil in zip(HV_states, self)]
-		message = self.convert_bool_list_to_Arduino_message(HV_states)
-		self.logger.debug(f"HV command: {message}")
+		messages = [self.convert_bool_list_to_Arduino_message(HV_states[s]) for s in self.slices]
+		self.logger.debug("HV command: %s", messages)
 
 		# Send command and message
-		self.arduino.send(Arduino.HV)
-		self.arduino.send(message)
-
-		response = self.arduino.read()
-		if not Arduino.HV_RESPONSE in response:
-			self.logger.critical(f"Arduino did not set HV to CBs correctly. Responded with: '{response}'")
-			raise CommunicationError(f"Arduino did not set HV to CBs correctly. Responded with: '{response}'")
+		for response in self._command(Arduino.HV, messages):
+			if not Arduino.HV_RESPONSE in response:
+				self.logger.critical(f"Arduino did not set HV to CBs correctly. Responded with: '{response}'")
+				raise CommunicationError(f"Arduino did not set HV to CBs correctly. Responded with: '{response}'")
 		self.logger.debug(f"HV set")
 
 	def HV_ALL(self, HV_state: bool = False):
@@ -265,24 +332,21 @@ class Coilgun:
 
 	def START_COUNTDOWN(self):
 		"""Start the countdown"""
-		self.arduino.send(Arduino.COUNTDOWN)
-		response = self.arduino.read()
-		if not response == Arduino.COUNTDOWN_RESPONSE:
-			self.logger.warning(f"Arduino did not start a countdown correctly. Responded with: '{response}")
-			# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
-		else:
-			self.logger.debug(f"Contdown started")
+		for response in self._command(Arduino.COUNTDOWN):
+			if not response == Arduino.COUNTDOWN_RESPONSE:
+				self.logger.warning(f"Arduino did not start a countdown correctly. Responded with: '{response}")
+				# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
+			else:
+				self.logger.debug(f"Contdown started")
 
 	def DISPLAY_CHARGE(self, percent):
 		"""Display the current percentage of the maximum voltage"""
-		self.arduino.send(Arduino.DISPLAY_CHARGE)
-		self.arduino.send(str(percent))
-		response = self.arduino.read()
-		if not Arduino.DISPLAY_CHARGE_RESPONSE in response:
-			self.logger.warning(f"Arduino did not display the charge correctly. Responded with: '{response}")
-			# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
-		else:
-			self.logger.debug(f"Displaying charge of {percent:.01%}")
+		for response in self._command(Arduino.DISPLAY_CHARGE, [str(percent)] * len(self.arduinos)):
+			if not Arduino.DISPLAY_CHARGE_RESPONSE in response:
+				self.logger.warning(f"Arduino did not display the charge correctly. Responded with: '{response}")
+				# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
+			else:
+				self.logger.debug("Displaying charge of %.1f%%", percent * 100)
 
 	def CHARGE_COILGUN(self, max_voltages: list[float]):
 		"""Charge the coilgun"""
@@ -300,8 +364,8 @@ class Coilgun:
 					HV_on_off.append(coil.control_voltage(voltage, max_voltage))
 				self.HV_2_CB(HV_on_off)
 
-				self.logger.info(f"Voltages are: {voltages}V")
-				self.logger.debug(f"HV that are on are: {HV_on_off}")
+				self.logger.info("Voltages are: %sV", voltages)
+				self.logger.debug("HV that are on are: %s", HV_on_off)
 		except KeyboardInterrupt:
 			self.logger.info(f"Charge of coilgun was stopped manually at: {voltages}V")
 			self.ABORT()
@@ -313,39 +377,75 @@ class Coilgun:
 
 	def SENSORS(self):
 		"""Get the state of all the sensors. (Only used for testing)"""
-		self.arduino.send(Arduino.SENSORS)
-		response = self.arduino.read()
+		response = Arduino.SEP.join(self._join([r.split(Arduino.SEP) for r in self._command(Arduino.SENSORS)]))
 
 		self.logger.debug(f"Sensors values are: {response}")
 		return response
 
 	def BLINK(self):
-		self.arduino.send(Arduino.BLINK)
-		response = self.arduino.read()
-		if not response == Arduino.BLINK_RESPONSE:
-			self.logger.warning(f"Arduino did not start blinking correctly. Responded with: '{response}")
-			# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
-		else:
-			self.logger.debug(f"Arduino is now blinking")
+		for response in self._command(Arduino.BLINK):
+			if not response == Arduino.BLINK_RESPONSE:
+				self.logger.warning(f"Arduino did not start blinking correctly. Responded with: '{response}")
+				# raise CommunicationError(f"Arduino did not turn on main HV correctly. Responded with: '{response}")
+			else:
+				self.logger.debug(f"Arduino is now blinking")
 
 	def ABORT(self):
 		"""Abort command execution on Arduino"""
 		time.sleep(0.01)
-		self.arduino.flush_serial()
-		self.arduino.send(Arduino.ABORT)
-		response = self.arduino.read()
+		for arduino in self.arduinos:
+			arduino.flush_serial()
+		responses = self._command(Arduino.ABORT)
 
 		self.logger.debug("Aborting execution off command on Arduino")
 
-		if not response == Arduino.ABORT_RESPONSE:
-			self.logger.critical(f"Arduino did not abort correctly. Responded with: '{response}'")
-			raise CommunicationError(f"Arduino did not abort correctly. Responded with: '{response}'")
+		for response in responses:
+			if not response == Arduino.ABORT_RESPONSE:
+				self.logger.critical(f"Arduino did not abort correctly. Responded with: '{response}'")
+				raise CommunicationError(f"Arduino did not abort correctly. Responded with: '{response}'")
 
 		
 
 	def convert_bool_list_to_Arduino_message(self, bool_list) -> str:
-		"""Convert a list of booleans to a message the Arduino can read"""
-		return ''.join(['1' if CB else '0' for CB in bool_list])
+		"""
+		Convert a list of booleans to a message the Arduino can read.
+		The list is packed to a bitmask (bit i is coil i) and sent as hex
+		"""
+		mask = 0
+		for i, CB in enumerate(bool_list):
+			if CB:
+				mask |= 1 << i
+		return f"{mask:0{max(1, (len(bool_list) + 3) // 4)}X}"
+
+	def on_all(self, func) -> list:
+		"""
+		Call func(index, arduino) for all controllers in parallel and return the results in order.
+		A single controller is called directly. The coils of controller 'index' are self.slices[index]
+		"""
+		if self._executor is None:
+			return [func(0, self.arduino)]
+		return list(self._executor.map(func, range(len(self.arduinos)), self.arduinos))
+
+	def _command(self, command: str, messages: list[str] = None, responses: int = 1) -> list:
+		"""
+		Send a command (and one message per controller) to all controllers and read their responses.
+		Return one response per controller, or a tuple of responses if more than one is expected
+		"""
+		def run(i: int, arduino: Arduino):
+			arduino.send(command)
+			if messages is not None:
+				arduino.send(messages[i])
+			if responses == 1:
+				return arduino.read()
+			return tuple(arduino.read() for _ in range(responses))
+		return self.on_all(run)
+
+	def _join(self, per_controller: list[list]) -> list:
+		"""Join per controller values to one value per coil"""
+		joined = []
+		for values, n in zip(per_controller, self.controller_coils):
+			joined.extend(values[:n])
+		return joined
 
 	def efficiency(self, voltages: list[float], velocities: list[float]) -> list[float]:
 		"""Calculate coilgun efficiency"""
@@ -367,7 +467,10 @@ class Coilgun:
 		self.ABORT()
 		self.logger.info("Shutting down coilgun...")
 		self.OFF()
-		self.arduino.close()
+		for arduino in self.arduinos:
+			arduino.close()
+		if self._executor is not None:
+			self._executor.shutdown()
 		self.logger.info("Shutdown sucessfull!")
 
 	def __len__(self) -> int:
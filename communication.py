@@ -22,6 +22,8 @@ class Arduino:
 	SENSORS = "SENSORS"
 	ABORT = "ABORT"
 	BLINK = "BLINK"
+	COILS = "COILS" 			# Set the number of coils on a controller
+	ARM = "ARM" 				# Fire when the controller before this one hands off the projectile
 
 	# Expected responses
 	OK = "OK"			# A good test
@@ -35,10 +37,13 @@ class Arduino:
 	SENSOR_RESPONSE = "Sensors are: "
 	ABORT_RESPONSE = "ABORTING"
 	BLINK_RESPONSE = "BLINKING"
+	COILS_RESPONSE = "COILS SET TO: "
+	ARM_RESPONSE = "ARMED"
 
 	# Communication chars
 	END = '\n'
 	SEP = ','
+	END_BYTES = bytes(END, 'utf-8')
 
 
 	def __init__(self, port: str, baudrate: int, timeout: int=10):
@@ -59,13 +64,17 @@ class Arduino:
 
 	def read(self) -> str:
 		"""Read a response from the Arduino"""
-		response = ""
+		return self.read_bytes().decode('utf-8')
+
+	def read_bytes(self) -> bytearray:
+		"""Read a response from the Arduino without decoding it"""
+		response = bytearray()
 		while True:
-			char = self.arduino.read().decode('utf-8')
-			if Arduino.END == char:
+			# Returns early without END if the read times out
+			response += self.arduino.read_until(Arduino.END_BYTES)
+			if response.endswith(Arduino.END_BYTES):
 				break
-			elif char:
-				response += char
+		del response[-len(Arduino.END_BYTES):]
 		return response
 
 	def test_connection(self, test_times: int=10) -> bool:
@@ -1,22 +1,21 @@
-# Projectile
-# projectile_diameter = 8.8e-3 	# [m]
-# projectile_mass = 3.0e-3 		# [kg]
-projectile_diameter = 16e-3 	# [m]
-projectile_mass = 2.3e-3 		# [kg]
-
-# Arduino
-port = "/dev/cu.usbmodem14201"
-baudrate = 115200
-timeout = 10            # [s]
+# Rig (projectile, Arduinos and coils)
+rig_file = "coils.yaml"
 
 # Logger
 import logging
 
-# File logger
-logfile = "log.txt"
+# File logger (structured records, one JSON object per line)
+logfile = "log.jsonl"
 filemode = 'w'
 file_logger_level = logging.DEBUG
-file_logger_format = '%(asctime)s : %(name)s : %(levelname)s : %(message)s'
+
+# ADC readings from the debug log, encoded with codec.py (set to None to keep them in logfile)
+adc_logfile = "log_adc.cgz"
+adc_log_block = 1000        # Readings per encoded block
+
+# Log queue between the control loop and the log handlers
+log_queue_size = 10000
+log_drop_policy = 'oldest'       # 'oldest' or 'newest'
 
 # Console logger
 console_logger_level = logging.INFO
@@ -24,3 +23,18 @@ console_logger_format = '%(levelname)s : %(message)s'
 
 # Data logging
 data_logging_path = "data_loggs/friction_test/data"
+
+# Live dashboard (set to None to disable)
+dashboard_port = 8050
+
+# Shared memory telemetry ring for other local processes (set to None to disable)
+telemetry_bus_name = "coilgun_telemetry"
+telemetry_bus_capacity = 4096       # Number of samples kept in the ring
+
+# Worker process that owns the Arduinos
+worker_period = 0.1     # Time between voltage readings while charging [s]
+worker_nice = -10       # Priority change for the worker (needs permission to go below 0)
+
+# Measurement uncertainty of logged shots (uncertainty.py). The tolerances are in the rig file
+uncertainty_samples = 10000         # Monte Carlo samples per shot
+uncertainty_confidence = 0.95
@@ -0,0 +1,310 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import deque
+import threading
+import hashlib
+import base64
+import struct
+import json
+import time
+
+
+class MinMaxTrace:
+	"""
+	Min/max decimated trace with a fixed number of buckets.
+	When all buckets are used, neighbouring buckets are merged so the trace
+	always covers the whole session with at most 'size' buckets
+	"""
+
+	def __init__(self, channels: int, size: int = 256):
+		self.channels = channels
+		self.size = size - size % 2
+		# Number of samples in each bucket
+		self.width = 1
+
+		self.times = []
+		self.mins = []
+		self.maxs = []
+
+		# Bucket that is currently being filled
+		self._count = 0
+
+	def add(self, t: float, values: list[float]):
+		"""Add a sample with one value per channel"""
+		if self._count == 0:
+			if len(self.times) == self.size:
+				self._merge()
+			self.times.append(t)
+			self.mins.append(list(values))
+			self.maxs.append(list(values))
+		else:
+			mins = self.mins[-1]
+			maxs = self.maxs[-1]
+			for i, v in enumerate(values):
+				if v < mins[i]:
+					mins[i] = v
+				if v > maxs[i]:
+					maxs[i] = v
+		self._count = (self._count + 1) % self.width
+
+	def _merge(self):
+		"""Merge neighbouring buckets pairwise and double the bucket width"""
+		self.times = self.times[::2]
+		self.mins = [[min(a, b) for a, b in zip(m1, m2)] for m1, m2 in zip(self.mins[::2], self.mins[1::2])]
+		self.maxs = [[max(a, b) for a, b in zip(m1, m2)] for m1, m2 in zip(self.maxs[::2], self.maxs[1::2])]
+		self.width *= 2
+
+	def to_dict(self) -> dict:
+		return {'t': self.times, 'min': self.mins, 'max': self.maxs}
+
+
+class Dashboard:
+	"""
+	Live telemetry dashboard served over HTTP with a WebSocket feed.
+	The control loop only appends to an inbox. Decimation, serialization and
+	serving all run on background threads
+	"""
+
+	VOLTAGES = 0
+	CHARGE = 1
+	SHOT = 2
+
+	def __init__(
+		self,
+		coils: int,
+		port: int,
+		host: str = "127.0.0.1",
+		buckets: int = 256,
+		shots: int = 10,
+		interval: float = 0.2 		# Time between frames [s]
+	):
+		self.coils = coils
+		self.host = host
+		self.port = port
+		self.interval = interval
+
+		self.trace = MinMaxTrace(coils, buckets)
+		self.charge = 0.0
+		self.shots = deque(maxlen=shots)
+
+		self._inbox = deque()
+		self._frame = b''
+		self._frame_id = 0
+		self._frame_ready = threading.Condition()
+		self._running = False
+		self._start_time = time.monotonic()
+
+		Handler = type('Handler', (DashboardRequestHandler,), {'dashboard': self})
+		self._server = ThreadingHTTPServer((host, port), Handler)
+		self._server.daemon_threads = True
+
+		self._threads = [
+			threading.Thread(target=self._server.serve_forever, name="dashboard-http", daemon=True),
+			threading.Thread(target=self._render_loop, name="dashboard-render", daemon=True),
+		]
+
+	# Called from the control loop. Keep these cheap
+
+	def add_voltages(self, voltages):
+		"""Add a voltage reading for all the coils"""
+		self._inbox.append((Dashboard.VOLTAGES, time.monotonic(), voltages))
+
+	def set_charge(self, percent: float):
+		"""Set the charge progress (0-1)"""
+		self._inbox.append((Dashboard.CHARGE, time.monotonic(), percent))
+
+	def add_shot(self, voltages, velocities, efficiencies, total_efficiency: float):
+		"""Add the result of a shot"""
+		self._inbox.append((Dashboard.SHOT, time.time(), (voltages, velocities, efficiencies, total_efficiency)))
+
+	# Background
+
+	def start(self):
+		"""Start serving the dashboard"""
+		self._running = True
+		for thread in self._threads:
+			thread.start()
+
+	def stop(self):
+		"""Stop serving the dashboard"""
+		self._running = False
+		with self._frame_ready:
+			self._frame_ready.notify_all()
+		self._server.shutdown()
+		self._server.server_close()
+
+	@property
+	def url(self) -> str:
+		return f"http://{self.host}:{self.port}/"
+
+	def _render_loop(self):
+		"""Move everything from the inbox into the dashboard state and build a new frame"""
+		while self._running:
+			self._drain_inbox()
+			frame = json.dumps({
+				'coils': self.coils,
+				'charge': self.charge,
+				'trace': self.trace.to_dict(),
+				'shots': list(self.shots),
+			}).encode('utf-8')
+			with self._frame_ready:
+				self._frame = frame
+				self._frame_id += 1
+				self._frame_ready.notify_all()
+			time.sleep(self.interval)
+
+	def _drain_inbox(self):
+		while self._inbox:
+			kind, t, data = self._inbox.popleft()
+			if kind == Dashboard.VOLTAGES:
+				self.trace.add(t - self._start_time, [float(v) for v in data])
+			elif kind == Dashboard.CHARGE:
+				self.charge = float(data)
+			elif kind == Dashboard.SHOT:
+				voltages, velocities, efficiencies, total_efficiency = data
+				self.shots.appendleft({
+					'time': t,
+					'voltages': [float(v) for v in voltages],
+					'velocities': [float(v) for v in velocities],
+					'efficiencies': [float(e) for e in efficiencies],
+					'total_efficiency': float(total_efficiency),
+				})
+
+	def _wait_for_frame(self, last_id: int) -> tuple[int, bytes]:
+		"""Block until a frame newer than 'last_id' exists"""
+		with self._frame_ready:
+			while self._running and self._frame_id == last_id:
+				self._frame_ready.wait()
+			return self._frame_id, self._frame
+
+
+class DashboardRequestHandler(BaseHTTPRequestHandler):
+	"""Serve the dashboard page and push frames to WebSocket clients"""
+
+	# WebSocket upgrades require HTTP/1.1
+	protocol_version = "HTTP/1.1"
+
+	WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+	dashboard: Dashboard = None
+
+	def do_GET(self):
+		if self.path == '/ws' and self.headers.get('Upgrade', '').lower() == 'websocket':
+			self._websocket()
+		elif self.path == '/':
+			body = DASHBOARD_HTML.encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/html; charset=utf-8')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		else:
+			self.send_error(404)
+
+	def _websocket(self):
+		key = self.headers.get('Sec-WebSocket-Key', '')
+		accept = base64.b64encode(hashlib.sha1((key + self.WS_GUID).encode('ascii')).digest()).decode('ascii')
+		self.send_response(101)
+		self.send_header('Upgrade', 'websocket')
+		self.send_header('Connection', 'Upgrade')
+		self.send_header('Sec-WebSocket-Accept', accept)
+		self.end_headers()
+
+		frame_id = 0
+		try:
+			while self.dashboard._running:
+				frame_id, frame = self.dashboard._wait_for_frame(frame_id)
+				self.wfile.write(websocket_text_frame(frame))
+				self.wfile.flush()
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+		self.close_connection = True
+
+	def log_message(self, format, *args):
+		"""Don't print every request to the console"""
+		pass
+
+
+def websocket_text_frame(payload: bytes) -> bytes:
+	"""Wrap a payload in an unmasked WebSocket text frame"""
+	length = len(payload)
+	if length < 126:
+		header = struct.pack('!BB', 0x81, length)
+	elif length < 2**16:
+		header = struct.pack('!BBH', 0x81, 126, length)
+	else:
+		header = struct.pack('!BBQ', 0x81, 127, length)
+	return header + payload
+
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Coilgun</title>
+<style>
+	body { font-family: sans-serif; margin: 1em; }
+	#bar { width: 100%; height: 1.5em; border: 1px solid #444; }
+	#fill { height: 100%; width: 0; background: #c33; }
+	table { border-collapse: collapse; margin-top: 1em; }
+	td, th { border: 1px solid #ccc; padding: 0.2em 0.5em; text-align: right; }
+</style>
+</head>
+<body>
+<h2>Coilgun</h2>
+<div id="bar"><div id="fill"></div></div>
+<canvas id="trace" width="1000" height="400"></canvas>
+<table id="shots"></table>
+<script>
+const colors = ['#e6194b', '#3cb44b', '#4363d8', '#f58231', '#911eb4', '#42d4f4', '#f032e6', '#9a6324'];
+const canvas = document.getElementById('trace');
+const ctx = canvas.getContext('2d');
+
+function draw(trace, coils) {
+	ctx.clearRect(0, 0, canvas.width, canvas.height);
+	const n = trace.t.length;
+	if (n === 0) return;
+	let vmax = 1;
+	for (const m of trace.max) for (const v of m) vmax = Math.max(vmax, v);
+	const t0 = trace.t[0], t1 = Math.max(trace.t[n - 1], t0 + 1e-3);
+	const x = t => (t - t0) / (t1 - t0) * (canvas.width - 1);
+	const y = v => canvas.height - 1 - v / vmax * (canvas.height - 20);
+	for (let c = 0; c < coils; c++) {
+		ctx.strokeStyle = colors[c % colors.length];
+		ctx.beginPath();
+		for (let i = 0; i < n; i++) {
+			ctx.moveTo(x(trace.t[i]), y(trace.min[i][c]));
+			ctx.lineTo(x(trace.t[i]), y(trace.max[i][c]) - 1);
+		}
+		ctx.stroke();
+	}
+	ctx.fillStyle = '#000';
+	ctx.fillText(vmax.toFixed(0) + ' V', 2, 12);
+}
+
+function fmt(values, digits) { return values.map(v => v.toFixed(digits)).join(', '); }
+
+function table(shots) {
+	let html = '<tr><th>Time</th><th>Voltages [V]</th><th>Velocities [m/s]</th><th>Efficiency [%]</th><th>Total [%]</th></tr>';
+	for (const s of shots) {
+		html += '<tr><td>' + new Date(s.time * 1000).toLocaleTimeString() + '</td><td>' + fmt(s.voltages, 0) +
+			'</td><td>' + fmt(s.velocities, 2) + '</td><td>' + fmt(s.efficiencies.map(e => e * 100), 2) +
+			'</td><td>' + (s.total_efficiency * 100).toFixed(2) + '</td></tr>';
+	}
+	document.getElementById('shots').innerHTML = html;
+}
+
+function connect() {
+	const ws = new WebSocket('ws://' + location.host + '/ws');
+	ws.onmessage = event => {
+		const frame = JSON.parse(event.data);
+		document.getElementById('fill').style.width = (Math.min(frame.charge, 1) * 100) + '%';
+		draw(frame.trace, frame.coils);
+		table(frame.shots);
+	};
+	ws.onclose = () => setTimeout(connect, 1000);
+}
+connect();
+</script>
+</body>
+</html>
+"""
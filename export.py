@@ -0,0 +1,325 @@
+"""
+Export all shot logs and current traces to one chunked HDF5 file that is also
+a MAT v7.3 file, so Python (h5py) and MATLAB (load, h5read) can read only the
+shots they need instead of parsing every CSV.
+
+Layout:
+	/shots/<campaign>/velocities, voltages, ...		(shots, coils), nan for coils without data
+	/shots/<campaign>/time 							(shots,) POSIX time from the file name
+	/shots/<campaign>/files 						file names as a char matrix
+	/shots/<campaign>/raw/raw_voltages, ... 		(shots, coils) raw readings from the .cgz files, -1 if missing
+	/index/by_voltage/voltage, time, campaign, shot	all shots sorted by charge voltage
+	/index/by_time/voltage, time, campaign, shot 	all shots sorted by time
+	/traces/<folder>/<trace> 						(samples, 2) time and current
+
+A campaign is a folder of shot logs (e.g. opt_first_coil/200_2 becomes
+opt_first_coil_200_2). MATLAB sees every array transposed, so shots are
+columns there. The campaign numbers in the index are 1-based so they can be
+used directly in MATLAB, e.g.
+	v = h5read('archive.mat', '/shots/opt_first_coil_200_2/velocities', [1 1], [1 Inf]);
+reads the first coil of every shot in that campaign
+"""
+from shot_logs import COLUMNS, load_logs, log_time
+from codec import read_streams
+from datetime import datetime
+import numpy as np
+import argparse
+import platform
+import re
+import os
+
+
+# MAT v7.3 files are HDF5 files with this 512 byte user block
+MAT_USERBLOCK_SIZE = 512
+MAT_VERSION = b'\x00\x02'
+MAT_ENDIAN = b'IM'
+
+# MATLAB class of each NumPy dtype (kind, itemsize)
+MATLAB_CLASSES = {
+	('f', 8): 'double', ('f', 4): 'single',
+	('i', 1): 'int8', ('i', 2): 'int16', ('i', 4): 'int32', ('i', 8): 'int64',
+	('u', 1): 'uint8', ('u', 2): 'uint16', ('u', 4): 'uint32', ('u', 8): 'uint64',
+}
+
+# Shots per chunk
+CHUNK_SHOTS = 256
+
+# Raw readings from the .cgz files written by log_shot
+RAW_STREAMS = ('raw_voltages', 'blocking_times_us', 'trigger_times_us')
+
+INDEX_FIELDS = ('voltage', 'time', 'campaign', 'shot')
+
+
+def mat_header() -> bytes:
+	"""User block that makes MATLAB recognize the HDF5 file as a MAT file"""
+	text = (
+		f"MATLAB 7.3 MAT-file, Platform: {platform.system()}, "
+		f"Created on: {datetime.now():%a %b %d %H:%M:%S %Y} HDF5 schema 1.00 ."
+	).encode('ascii')
+	header = text[:116].ljust(116, b' ') + bytes(8) + MAT_VERSION + MAT_ENDIAN
+	return header.ljust(MAT_USERBLOCK_SIZE, b'\x00')
+
+
+def matlab_name(name: str) -> str:
+	"""Valid MATLAB field name for a folder name"""
+	name = re.sub(r'\W', '_', name)
+	if not name or not name[0].isalpha():
+		name = 'c_' + name
+	return name[:63]
+
+
+def _dataset(group, name: str, data: np.ndarray, chunked: bool = False, matlab_class: str = None):
+	"""Create a dataset with the class MATLAB needs to load it. The class follows the dtype if it isn't given"""
+	if matlab_class is None:
+		try:
+			matlab_class = MATLAB_CLASSES[data.dtype.kind, data.dtype.itemsize]
+		except KeyError:
+			raise TypeError(f"MATLAB has no class for the dtype {data.dtype} of '{name}'")
+	chunks = None
+	if chunked and data.size:
+		chunks = (min(len(data), CHUNK_SHOTS),) + data.shape[1:]
+	dataset = group.create_dataset(name, data=data, chunks=chunks)
+	dataset.attrs['MATLAB_class'] = np.bytes_(matlab_class)
+	if matlab_class == 'char':
+		# UTF-16 code units
+		dataset.attrs['MATLAB_int_decode'] = np.int32(2)
+	return dataset
+
+
+def _group(parent, name: str):
+	group = parent.create_group(name)
+	group.attrs['MATLAB_class'] = np.bytes_('struct')
+	return group
+
+
+def _char_matrix(strings: list[str]) -> np.ndarray:
+	"""MATLAB char matrix with one string per row (stored transposed)"""
+	width = max((len(s) for s in strings), default=0)
+	chars = np.full((len(strings), width), ord(' '), dtype=np.uint16)
+	for i, s in enumerate(strings):
+		chars[i, :len(s)] = [ord(c) for c in s]
+	return chars.T
+
+
+def _raw_readings(files: list[str], coils: int) -> dict | None:
+	"""Raw readings from the .cgz files next to the shot logs. None if there are none"""
+	raw = {name: np.full((len(files), coils), -1, dtype=np.int64) for name in RAW_STREAMS}
+	found = False
+	for i, filename in enumerate(files):
+		cgz = os.path.splitext(filename)[0] + '.cgz'
+		if not os.path.exists(cgz):
+			continue
+		found = True
+		for name, values in read_streams(cgz).items():
+			if name in raw:
+				raw[name][i, :len(values)] = values
+	return raw if found else None
+
+
+def _traces(root: str) -> dict:
+	"""Current traces (time, current) in .txt files. Folder: {trace name: (samples, voltage)}"""
+	traces = {}
+	for folder, _, filenames in sorted(os.walk(root)):
+		found = {}
+		for filename in sorted(filenames):
+			if not filename.endswith('.txt'):
+				continue
+			try:
+				trace = np.loadtxt(os.path.join(folder, filename), delimiter=',', ndmin=2)
+			except ValueError:
+				continue
+			if trace.shape[1] == 2:
+				found[os.path.splitext(filename)[0]] = trace
+		if not found:
+			continue
+
+		# The measured voltage of each trace, in the same order as the trace files
+		voltages = [np.nan] * len(found)
+		exact = os.path.join(folder, 'ExaktVoltage.txt')
+		if os.path.exists(exact):
+			with open(exact) as exact_file:
+				measured = [float(line.split()[0]) for line in exact_file if line.strip()]
+			if len(measured) == len(found):
+				voltages = measured
+		traces[os.path.relpath(folder, root)] = {
+			name: (trace, voltage) for (name, trace), voltage in zip(found.items(), voltages)
+		}
+	return traces
+
+
+def export(root: str, filename: str) -> tuple[int, int, int]:
+	"""Export all shot logs and traces under root. Return the number of shots, campaigns and skipped files"""
+	import h5py
+
+	files, logs, skipped = load_logs([root])
+	shots, coils = logs['velocities'].shape
+	raw = _raw_readings(files, coils)
+
+	# Campaigns in the order of their folders
+	campaign_paths = sorted({os.path.relpath(os.path.dirname(f), root) for f in files})
+	campaign_of = np.array([campaign_paths.index(os.path.relpath(os.path.dirname(f), root)) for f in files], dtype=np.int64)
+	times = np.array([log_time(f) for f in files])
+	charge_voltages = np.max(np.nan_to_num(logs['voltages'], nan=-np.inf), axis=1, initial=-np.inf)
+
+	index = {
+		'voltage': charge_voltages,
+		'time': times,
+		'campaign': campaign_of + 1,
+		'shot': np.zeros(shots, dtype=np.int64),
+	}
+
+	# Write to a temporary file first so a failed export never leaves half a file
+	tmp_filename = filename + ".tmp"
+	with h5py.File(tmp_filename, 'w', userblock_size=MAT_USERBLOCK_SIZE) as archive:
+		shots_group = _group(archive, 'shots')
+		names = []
+		for c, path in enumerate(campaign_paths):
+			in_campaign = np.flatnonzero(campaign_of == c)
+			# Shots in a campaign are sorted by time
+			in_campaign = in_campaign[np.argsort(times[in_campaign], kind='stable')]
+			index['shot'][in_campaign] = np.arange(1, len(in_campaign) + 1)
+
+			name = matlab_name(path)
+			while name in names:
+				name += '_'
+			names.append(name)
+			group = _group(shots_group, name)
+			group.attrs['path'] = path
+			for column in COLUMNS:
+				dataset = _dataset(group, column, logs[column][in_campaign], chunked=True)
+				dataset.attrs['units'] = COLUMNS[column].split('[')[-1].rstrip(']')
+			_dataset(group, 'time', times[in_campaign], chunked=True)
+			_dataset(group, 'files', _char_matrix([os.path.basename(files[i]) for i in in_campaign]), matlab_class='char')
+			if raw is not None:
+				raw_group = _group(group, 'raw')
+				for stream in RAW_STREAMS:
+					_dataset(raw_group, stream, raw[stream][in_campaign], chunked=True)
+
+		index_group = _group(archive, 'index')
+		index_group.attrs['campaigns'] = names
+		# Shots without a time stamp go last
+		orders = {'by_voltage': np.argsort(index['voltage'], kind='stable'), 'by_time': np.argsort(index['time'], kind='stable')}
+		for order_name, order in orders.items():
+			order_group = _group(index_group, order_name)
+			for field in INDEX_FIELDS:
+				_dataset(order_group, field, index[field][order])
+
+		traces_group = _group(archive, 'traces')
+		for folder, traces in _traces(root).items():
+			folder_group = _group(traces_group, matlab_name(folder))
+			folder_group.attrs['path'] = folder
+			for name, (trace, voltage) in traces.items():
+				# Traces are contiguous so they can be memory-mapped
+				dataset = _dataset(folder_group, matlab_name(name), trace)
+				dataset.attrs['voltage'] = voltage
+
+	with open(tmp_filename, 'r+b') as archive_file:
+		archive_file.write(mat_header())
+	os.replace(tmp_filename, filename)
+	return shots, len(campaign_paths), skipped
+
+
+class ShotArchive:
+	"""Random access to an exported archive. Data is only read when it is selected"""
+
+	def __init__(self, filename: str):
+		import h5py
+
+		self.filename = filename
+		self.file = h5py.File(filename, 'r')
+		self.campaigns = list(self.file['index'].attrs['campaigns'])
+
+	def close(self):
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def campaign(self, name: str):
+		"""The group of a campaign. Its datasets can be sliced without reading the rest"""
+		return self.file['shots'][name]
+
+	def select(self, voltage: tuple[float, float] = None, time: tuple[datetime, datetime] = None, campaign: str = None) -> dict:
+		"""
+		Find shots by charge voltage range [V], time range and/or campaign.
+		Only the index is read. Return the index fields of the matching shots
+		"""
+		if time is not None:
+			order = self.file['index']['by_time']
+			bounds = [t.timestamp() if isinstance(t, datetime) else t for t in time]
+			key = order['time']
+		else:
+			order = self.file['index']['by_voltage']
+			bounds = voltage if voltage is not None else (-np.inf, np.inf)
+			key = order['voltage']
+
+		# The index is sorted, so only the key is read in full
+		keys = key[:]
+		start = np.searchsorted(keys, bounds[0], side='left')
+		stop = np.searchsorted(keys, bounds[1], side='right')
+		selected = {field: order[field][start:stop] for field in INDEX_FIELDS}
+
+		keep = np.ones(stop - start, dtype=bool)
+		if time is not None and voltage is not None:
+			keep &= (selected['voltage'] >= voltage[0]) & (selected['voltage'] <= voltage[1])
+		if campaign is not None:
+			keep &= selected['campaign'] == self.campaigns.index(campaign) + 1
+		return {field: values[keep] for field, values in selected.items()}
+
+	def read(self, selected: dict, fields: list[str] = tuple(COLUMNS)) -> dict:
+		"""
+		Read the fields of the shots from select(), in the same order.
+		Raw readings are read with fields like 'raw/raw_voltages'
+		"""
+		count = len(selected['shot'])
+		groups = list(self.file['shots'].values())
+		out = {}
+		for field in fields:
+			# Any campaign with the field gives the dtype and shape, so an empty selection gives empty arrays
+			template = next((group[field] for group in groups if field in group), None)
+			if template is None:
+				if groups:
+					raise KeyError(f"No campaign has the field '{field}'")
+				out[field] = np.full(count, np.nan)
+				continue
+			fill = np.nan if template.dtype.kind == 'f' else -1
+			out[field] = np.full((count,) + template.shape[1:], fill, dtype=template.dtype)
+
+		for c in np.unique(selected['campaign']):
+			group = self.campaign(self.campaigns[c - 1])
+			rows = np.flatnonzero(selected['campaign'] == c)
+			# HDF5 reads increasing rows
+			shots = selected['shot'][rows] - 1
+			order = np.argsort(shots)
+			for field in fields:
+				# Campaigns without the field (e.g. no raw readings) keep the fill value
+				if field in group:
+					out[field][rows[order]] = group[field][shots[order]]
+		return out
+
+	def trace(self, folder: str, name: str) -> np.ndarray:
+		"""A current trace (e.g. 'CurrentCoil1', '300V'). Memory-mapped when the dataset is stored contiguously"""
+		dataset = self.file['traces'][matlab_name(folder)][matlab_name(name)]
+		offset = dataset.id.get_offset()
+		if offset is None:
+			return dataset[:]
+		return np.memmap(self.filename, mode='r', dtype=dataset.dtype, offset=offset, shape=dataset.shape)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('root', nargs='?', default='data_loggs', help="Folder with the shot logs and traces")
+	parser.add_argument('-o', '--output', default='data_loggs/archive.mat', help="HDF5 / MAT v7.3 file")
+	args = parser.parse_args()
+
+	shots, campaigns, skipped = export(args.root, args.output)
+	if skipped:
+		print(f"Skipped {skipped} files that are not shot logs")
+	print(f"Exported {shots} shots in {campaigns} campaigns to {args.output}")
+
+
+if __name__ == '__main__':
+	main()
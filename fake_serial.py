@@ -0,0 +1,177 @@
+from communication import Arduino
+import random
+
+
+class FakeSerial:
+	"""
+	Serial port that behaves like the Arduino firmware.
+	Simulates charging, draining and firing of the capacitor banks so the
+	whole stack can be run without hardware
+	"""
+
+	def __init__(
+		self,
+		coils: int = 8,
+		R1: float = 22e6,
+		R2: float = 82e3,
+		charge_rate: float = 40, 	# Voltage increase per voltage reading when charging [V]
+		seed: int = None
+	):
+		self.coils = coils
+		self.R1 = R1
+		self.R2 = R2
+		self.charge_rate = charge_rate
+		self.random = random.Random(seed)
+
+		self.voltages = [0.0] * coils
+		# Coils in use (set with COILS)
+		self.active = coils
+		self.main_HV = False
+		self.HV_mask = 0
+		self.drain_mask = 0
+
+		self._input = bytearray()
+		self._output = bytearray()
+		# Command waiting for its message (HV, DRAIN, DISPLAY_CHARGE and COILS)
+		self._pending = None
+		self._header = True
+
+		self.is_open = True
+
+	# pyserial interface
+
+	def write(self, data: bytes) -> int:
+		self._input += data
+		self._process()
+		return len(data)
+
+	def read(self, size: int = 1) -> bytes:
+		data = bytes(self._output[:size])
+		del self._output[:size]
+		return data
+
+	def read_until(self, expected: bytes = b'\n', size: int = None) -> bytes:
+		end = self._output.find(expected)
+		end = len(self._output) if end < 0 else end + len(expected)
+		if size is not None:
+			end = min(end, size)
+		data = bytes(self._output[:end])
+		del self._output[:end]
+		return data
+
+	@property
+	def in_waiting(self) -> int:
+		return len(self._output)
+
+	def reset_input_buffer(self):
+		self._output.clear()
+
+	def reset_output_buffer(self):
+		pass
+
+	def close(self):
+		self.is_open = False
+
+	# Firmware
+
+	def _print(self, message: str):
+		self._output += bytes(message + Arduino.END, 'utf-8')
+
+	def _process(self):
+		while self._input:
+			if self._header:
+				# Any byte wakes the firmware up
+				self._input.clear()
+				self._print(Arduino.OK)
+				self._header = False
+				continue
+			end = self._input.find(Arduino.END_BYTES)
+			if end < 0:
+				return
+			line = self._input[:end].decode('utf-8')
+			del self._input[:end + 1]
+			self._header = True
+			self._handle(line)
+
+	def _handle(self, line: str):
+		if self._pending is not None:
+			command, self._pending = self._pending, None
+			if command == Arduino.HV:
+				if line != Arduino.ABORT:
+					self.HV_mask = int(line, 16)
+				self._print(Arduino.HV_RESPONSE + line)
+			elif command == Arduino.DRAIN:
+				if line != Arduino.ABORT:
+					self.drain_mask = int(line, 16)
+				self._print(Arduino.DRAIN_RESPONSE + line)
+			elif command == Arduino.DISPLAY_CHARGE:
+				self._print(f"{Arduino.DISPLAY_CHARGE_RESPONSE}{float(line):.2f}")
+			elif command == Arduino.COILS:
+				if 1 <= int(line) <= self.coils:
+					self.active = int(line)
+				self._print(f"{Arduino.COILS_RESPONSE}{self.active}")
+			return
+
+		if line in (Arduino.HV, Arduino.DRAIN, Arduino.DISPLAY_CHARGE, Arduino.COILS):
+			self._pending = line
+		elif line == Arduino.READ_VOLTAGES:
+			self._update_voltages()
+			self._print(Arduino.SEP.join(str(self._to_ADC(v)) for v in self.voltages[:self.active]))
+		elif line == Arduino.FIRE:
+			self._fire()
+		elif line == Arduino.ARM:
+			# The handoff from the controller before arrives right away
+			self._print(Arduino.ARM_RESPONSE)
+			self._fire()
+		elif line == Arduino.ON:
+			self.main_HV = True
+			self._print(Arduino.HV_ON)
+		elif line == Arduino.OFF:
+			self.main_HV = False
+			self._print(Arduino.HV_OFF)
+		elif line == Arduino.CHARGE:
+			self._print(Arduino.CHARGE_RESPONSE)
+		elif line == Arduino.COUNTDOWN:
+			self._print(Arduino.COUNTDOWN_RESPONSE)
+		elif line == Arduino.BLINK:
+			self._print(Arduino.BLINK_RESPONSE)
+		elif line == Arduino.SENSORS:
+			self._print(Arduino.SEP.join(['1'] * self.active))
+		elif line == Arduino.ABORT:
+			self._print(Arduino.ABORT_RESPONSE)
+		elif line == Arduino.TEST:
+			self._print(Arduino.OK)
+		else:
+			self._print("UNKNOWN COMMAND... : " + line)
+
+	def _update_voltages(self):
+		"""Charge or drain the CBs since the last reading"""
+		for i in range(self.active):
+			# The drain relays are NC so a 0 drains the CB
+			if not (self.drain_mask >> i) & 1:
+				self.voltages[i] *= 0.5
+			elif self.main_HV and (self.HV_mask >> i) & 1:
+				self.voltages[i] += self.charge_rate * self.random.uniform(0.8, 1.2)
+
+	def _to_ADC(self, voltage: float) -> int:
+		return max(0, min(1023, int(voltage * self.R2 / (self.R1 + self.R2) * 1023 / 5)))
+
+	def _fire(self):
+		"""Dump the CBs and report blocking and trigger times in microseconds"""
+		blocking_times = []
+		trigger_times = []
+		t = 0
+		for i in range(self.active):
+			blocking_times.append(self.random.randint(300, 1500))
+			t += self.random.randint(2000, 6000)
+			trigger_times.append(t)
+			self.voltages[i] *= 0.1
+		self._print(Arduino.SEP.join(str(b) for b in blocking_times))
+		self._print(Arduino.SEP.join(str(t) for t in trigger_times))
+
+
+def fake_arduino(coils: int = 8, **kwargs) -> Arduino:
+	"""Create an Arduino that is connected to a FakeSerial"""
+	arduino = Arduino(port="fake", baudrate=115200)
+	arduino.arduino = FakeSerial(coils, **kwargs)
+	return arduino
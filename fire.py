@@ -1,21 +1,23 @@
-from communication import Arduino
-from coilgun import Coil, Coilgun
+from coilgun import Coilgun
+from worker import CoilgunWorker, WorkerClient, WorkerError
 import config
-import yaml
 import time
 from utils import print_data
+from log_queue import BlockingStopQueueListener, JsonLinesHandler, AdcStreamHandler, is_adc_record
+from codec import write_streams
+from shot_logs import TIME_FORMAT
+import multiprocessing
 import logging
 
 import numpy as np
-import pandas as pd
 from datetime import datetime
-import os
+from typing import TYPE_CHECKING
 
-# For logging of a shot
-# Number of windings on a coil
-windings = [200,150,150,100,100,100,100,0]
-# Position relative sensor [mm] (end of sensor to start of coil)
-positions = [30,14,23,32,32,35,38,0]
+if TYPE_CHECKING:
+	# Only imported in main, and only when the dashboard is enabled
+	from dashboard import Dashboard
+
+# pandas, the dashboard and the telemetry bus are imported when they are first used to keep startup fast
 
 
 def get_voltages(coils: int):
@@ -33,83 +35,94 @@ def get_voltages(coils: int):
 		voltages.append(volt)
 	return voltages
 
-def manual_fire(coilgun: Coilgun, voltage: float):
+def manual_fire(worker: WorkerClient, voltage: float, dashboard: 'Dashboard' = None):
 	"""Fire the coilgun manualy"""
-	coilgun.ON()
-	charged = False
+	worker.request(CoilgunWorker.CHARGE, voltage)
 	try: 
 		while True:
-			voltages = np.array(coilgun.READ_VOLTAGES())
-			percent = float(np.amax(voltages / voltage))
-			if percent >= 1:
-				if not charged:
-					charged = True
-					coilgun.BLINK()
-				percent = 1.0
-			coilgun.DISPLAY_CHARGE(percent)
-			print("\033[A                                                                         \033[A")
-			print_data(voltages, units='V')
-			time.sleep(0.1)
+			message = worker.recv(timeout=0.1)
+			if message is None:
+				continue
+			kind, *data = message
+			if kind == CoilgunWorker.ERROR:
+				raise WorkerError(data[0])
+			if kind == CoilgunWorker.VOLTAGES:
+				voltages, percent = data
+				if dashboard is not None:
+					dashboard.add_voltages(voltages)
+					dashboard.set_charge(percent)
+				print("\033[A                                                                         \033[A")
+				print_data(voltages, units='V')
 	except KeyboardInterrupt:
 		pass
-	except Exception as e:
+	except WorkerError as e:
 		print(e)
 		input("Something went wrong. Press enter to shoot so the CBs empty")
-		coilgun.FIRE()
+		worker.request(CoilgunWorker.FIRE_EMPTY)
 		time.sleep(1)
-		coilgun.OFF()
+		worker.request(CoilgunWorker.OFF)
 		quit()
 
-	coilgun.ABORT()
-	
-	# Countdown
-	coilgun.START_COUNTDOWN()
-	for i in range(3):
-		time.sleep(1)
-		print(3-i)
-	time.sleep(1)
-	print("FIRE!!!")
+	# Voltages read before the charge stopped are not needed anymore
+	worker.request(CoilgunWorker.STOP_CHARGE)
 
-	fire_voltages = np.array(coilgun.READ_VOLTAGES())
-	velocities, trigger_times = coilgun.FIRE()
+	# Countdown, fire and drain
+	result = {}
+	def on_message(message):
+		kind, data = message
+		if kind == CoilgunWorker.COUNTDOWN:
+			print(data if data > 0 else "FIRE!!!")
+		else:
+			result[kind] = data
+	worker.request(CoilgunWorker.FIRE, on_message=on_message)
 
-	coil_efficiency, total_efficiency = coilgun.efficiency(fire_voltages, velocities)
-	coil_efficiency = np.array(coil_efficiency)
+	shot = result[CoilgunWorker.SHOT]
+	fire_voltages = shot['voltages']
+	velocities = shot['velocities']
+	coil_efficiency = shot['efficiencies']
+	total_efficiency = shot['total_efficiency']
 
 	print_data(fire_voltages, units='V', prefix='Coilgun fired at: ')
 	print_data(velocities, units='m/s', prefix='Projectile velocity was: ')
 	print_data(coil_efficiency*100, units=r'%', prefix="Efficiency for all the coils was: ")
 	print(f"Total efficiency was {total_efficiency*100:.2f}%")
+	timing = shot['timing']
+	print(
+		f"Host latency was {timing['read_voltages_us']:.0f} us ({timing['read_voltages_jitter_us']:+.0f} us) to read the voltages, "
+		f"{timing['fire_us']:.0f} us ({timing['fire_jitter_us']:+.0f} us) to fire"
+	)
+	if dashboard is not None:
+		dashboard.add_shot(fire_voltages, velocities, coil_efficiency, total_efficiency)
 
 	log_shot(
 		filename=config.data_logging_path,
 		voltages=fire_voltages, 
 		velocities=velocities, 
 		efficiencies=coil_efficiency,
-		trigger_times=trigger_times
+		trigger_times=shot['trigger_times'],
+		windings=worker.rig.windings,
+		positions=worker.rig.positions,
+		raw={
+			'raw_voltages': shot['raw_voltages'],
+			'blocking_times_us': shot['blocking_times_us'],
+			'trigger_times_us': shot['trigger_times_us'],
+		}
 	)
 
-	time.sleep(1)
-	after_fire_voltages = np.array(coilgun.READ_VOLTAGES())
+	after_drain_voltages = result[CoilgunWorker.DRAINED]
 
-	# Drain all CBs that are safe to drain
-	coilgun.DRAIN_CB(after_fire_voltages < coilgun.MAX_VOLTAGE_FOR_SAFE_DRAIN)
-
-	time.sleep(1)
-	after_drain_voltages = np.array(coilgun.READ_VOLTAGES())
-
-	if np.any(after_drain_voltages > coilgun.MAX_VOLTAGE_FOR_SAFE_DRAIN):
+	if np.any(after_drain_voltages > Coilgun.MAX_VOLTAGE_FOR_SAFE_DRAIN):
 		print("Warning!!! Not all CBs are empty!")
 		print_data(after_drain_voltages, units='V', prefix="The voltages are: ")
 		if input("Empty CBs anyway (y/n): ") == 'y':
-			coilgun.DRAIN_ALL(True)
+			worker.request(CoilgunWorker.DRAIN_ALL)
 		else:
 			print_data(after_drain_voltages, units='V', prefix="Fire with coilgun at: ")
 			input("FIRE!!!")
-			coilgun.FIRE()
+			worker.request(CoilgunWorker.FIRE_EMPTY)
 			quit()
 	
-	coilgun.OFF()
+	worker.request(CoilgunWorker.OFF)
 
 def fire(coilgun: Coilgun):
 	"""Fire the coilgun"""
@@ -162,57 +175,77 @@ def fire(coilgun: Coilgun):
 	coilgun.OFF()
 
 
-def log_shot(filename, voltages, velocities, efficiencies, trigger_times):
-	"""Log a shot"""
-	
-	
+def log_shot(filename, voltages, velocities, efficiencies, trigger_times, windings, positions, raw=None):
+	"""
+	Log a shot. 'raw' is an optional dict of the integer readings (ADC values
+	and microsecond times) that are saved losslessly in a .cgz file next to the CSV
+	"""
+	import pandas as pd
+
+	coils = len(velocities)
 	data = {
-		'Velocities [m/s]': np.resize(velocities,8),
-		'Voltages [V]': np.resize(voltages,8),
-		'Efficiency [%]': np.resize(efficiencies * 100,8),
-		'Windings [-]': np.resize(windings,8),
-		'Positions [mm]': np.resize(positions,8),
-		'Trigger times [s]': np.resize(trigger_times,8)
+		'Velocities [m/s]': np.resize(velocities,coils),
+		'Voltages [V]': np.resize(voltages,coils),
+		'Efficiency [%]': np.resize(efficiencies * 100,coils),
+		'Windings [-]': np.resize(windings,coils),
+		'Positions [mm]': np.resize(positions,coils),
+		'Trigger times [s]': np.resize(trigger_times,coils)
 	}
 	df = pd.DataFrame(data=data)
 
-	df.to_csv(filename + "_" + datetime.now().strftime('%d-%m-%Y %H-%M-%S') + '.csv', mode='w', header=True)
+	filename = filename + "_" + datetime.now().strftime(TIME_FORMAT)
+	df.to_csv(filename + '.csv', mode='w', header=True)
+	if raw is not None:
+		write_streams(filename + '.cgz', raw)
 
 def main():
-	# Start communication with the Arduino
-	arduino = Arduino(config.port, config.baudrate, config.timeout)
-
-	print("Testing communication with the Arduino...")
-	if not arduino.connect():
-		print("Failed to connect to the Arduino.")
-		print("Quiting...")
-	print("Communication sucessfull!")
-
-	# Load coils from config and sort them (named coil1, coil2, ...)
-	with open("coils.yaml", "r") as yaml_file:
-		coils_dict = yaml.safe_load(yaml_file)
-	sorted_coils = sorted(coils_dict.keys())
-	coils = [Coil.from_dict(coils_dict[coil]) for coil in sorted_coils]
-
 	# Create a logger
 	logger = logging.getLogger('Coilgun')
 	logger.setLevel(logging.DEBUG)
 
-	# Add console logging to the logger
+	# Console logging
 	c_handler = logging.StreamHandler()
 	c_handler.setLevel(config.console_logger_level)
 	c_format = logging.Formatter(config.console_logger_format)
 	c_handler.setFormatter(c_format)
-	logger.addHandler(c_handler)
 
-	# Add file logger to the logger
-	f_handler = logging.FileHandler(filename=config.logfile, mode=config.filemode)
+	# Structured file logging
+	f_handler = JsonLinesHandler(filename=config.logfile, mode=config.filemode)
 	f_handler.setLevel(config.file_logger_level)
-	f_format = logging.Formatter(config.file_logger_format)
-	f_handler.setFormatter(f_format)
-	logger.addHandler(f_handler)
+	handlers = [c_handler, f_handler]
+
+	# ADC readings are encoded to their own file instead of the JSON lines
+	if config.adc_logfile is not None:
+		adc_handler = AdcStreamHandler(config.adc_logfile, mode=config.filemode, block_size=config.adc_log_block)
+		adc_handler.setLevel(config.file_logger_level)
+		f_handler.addFilter(lambda record: not is_adc_record(record))
+		handlers.append(adc_handler)
+
+	# The worker process puts its log records on the queue and this process writes them
+	log_queue = multiprocessing.Queue(config.log_queue_size)
+	log_listener = BlockingStopQueueListener(log_queue, *handlers, respect_handler_level=True)
+	log_listener.start()
+
+	# Start the worker that owns the Arduinos and the coilgun
+	worker = WorkerClient(log_queue, config.rig_file, config.worker_period)
+	print("Testing communication with the Arduino...")
+	try:
+		worker.start()
+	except WorkerError as e:
+		print(e)
+		print("Quiting...")
+		log_listener.stop()
+		for handler in handlers:
+			handler.close()
+		return
+	print("Communication sucessfull!")
 
-	coilgun = Coilgun(coils, arduino, config.projectile_diameter, config.projectile_mass, logger=logger)
+	dashboard = None
+	if config.dashboard_port is not None:
+		from dashboard import Dashboard
+		dashboard = Dashboard(len(worker.rig.coils), config.dashboard_port)
+		dashboard.start()
+		print(f"Dashboard running at {dashboard.url}")
 
 	try:
 		while True:
@@ -226,13 +259,16 @@ def main():
 				except ValueError:
 					print(f'Could not convert input {input_command} to a float')
 				else:
-					manual_fire(coilgun, voltage)
+					manual_fire(worker, voltage, dashboard)
 				
 	finally:
 		# Alwasy turn off HV and drain the CBs
-		# coilgun.shutdown()
-		pass
-	coilgun.shutdown()
+		worker.stop()
+		if dashboard is not None:
+			dashboard.stop()
+		log_listener.stop()
+		for handler in handlers:
+			handler.close()
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
@@ -0,0 +1,195 @@
+from communication import Arduino, CommunicationError
+from coilgun import Coilgun
+import numpy as np
+import logging
+import time
+import gc
+
+
+SEP = ord(Arduino.SEP)
+ZERO = ord('0')
+NINE = ord('9')
+
+
+def parse_ints_into(line: bytearray, out: np.ndarray, offset: int, count: int):
+	"""
+	Parse exactly 'count' comma separated integers from 'line' into out[offset:offset + count].
+	Creates no lists or strings, so nothing that the garbage collector tracks.
+	Raise CommunicationError if the line has another number of values or anything but digits
+	"""
+	value = 0
+	digits = 0
+	index = offset
+	stop = offset + count
+	for c in line:
+		if c == SEP:
+			if digits == 0 or index >= stop - 1:
+				break
+			out[index] = value
+			index += 1
+			value = 0
+			digits = 0
+		elif ZERO <= c <= NINE:
+			value = value * 10 + c - ZERO
+			digits += 1
+		else:
+			break
+	else:
+		if digits and index == stop - 1:
+			out[index] = value
+			return
+	raise CommunicationError(f"Expected {count} integers from the Arduino. Got: '{bytes(line).decode(errors='replace')}'")
+
+
+class FireWindow:
+	"""
+	Read the voltages, fire and calculate the efficiency with preallocated
+	buffers, no garbage collection and no DEBUG logging. Host side latencies
+	are measured for every shot
+	"""
+
+	# Timestamps taken in the window
+	START, VOLTAGES_READ, FIRED, DONE = range(4)
+	PHASES = ('read_voltages', 'fire', 'efficiency')
+
+	def __init__(self, coilgun: Coilgun, history: int = 50):
+		self.coilgun = coilgun
+		n = len(coilgun)
+
+		# Where each controller's values go in the per coil buffers
+		self._offsets = [s.start for s in coilgun.slices]
+
+		# Voltages
+		self.raw_voltages = np.zeros(n, dtype=np.int64)
+		self._coil_raw_voltages = np.zeros(n, dtype=np.int64)
+		self.voltages = np.zeros(n)
+		self._ids = np.array([coil.id for coil in coilgun], dtype=np.intp)
+		self._scale = np.array([5 / 1023 * (coil.R1 + coil.R2) / coil.R2 for coil in coilgun])
+
+		# Fire
+		self.blocking_times_us = np.zeros(n, dtype=np.int64)
+		self.trigger_times_us = np.zeros(n, dtype=np.int64)
+		self.blocking_times = np.zeros(n)
+		self.trigger_times = np.zeros(n)
+		self.velocities = np.zeros(n)
+
+		# Efficiency
+		self._half_capacitance = np.array([coil.capacitance / 2 for coil in coilgun])
+		self._half_mass = coilgun.projectile_mass / 2
+		self._v_in = np.zeros(n)
+		self._v_in_tail = self._v_in[1:]
+		self._velocities_head = self.velocities[:-1]
+		self._work = np.zeros(n)
+		self.energies = np.zeros(n)
+		self.efficiencies = np.zeros(n)
+		self.total_efficiency = 0.0
+
+		# Bind the per controller jobs once instead of in every shot
+		self._read_voltages_job = self._read_controller_voltages
+		self._fire_job = self._fire_controller
+
+		# Timing
+		self._stamps = np.zeros(4, dtype=np.int64)
+		self._history = np.zeros((history, len(FireWindow.PHASES)))
+		self._shots = 0
+
+	def fire(self) -> dict:
+		"""Fire the coilgun. Return copies of the results and the timing of this shot"""
+		logger = self.coilgun.logger
+		level = logger.level
+		gc_was_enabled = gc.isenabled()
+
+		gc.disable()
+		logger.setLevel(max(level, logging.INFO))
+		# Empty CBs and blocked sensors give inf/nan instead of warnings
+		np_errors = np.seterr(divide='ignore', invalid='ignore')
+		try:
+			stamps = self._stamps
+			stamps[FireWindow.START] = time.perf_counter_ns()
+			self._read_voltages()
+			stamps[FireWindow.VOLTAGES_READ] = time.perf_counter_ns()
+			self._fire()
+			stamps[FireWindow.FIRED] = time.perf_counter_ns()
+			self._efficiency()
+			stamps[FireWindow.DONE] = time.perf_counter_ns()
+		finally:
+			np.seterr(**np_errors)
+			logger.setLevel(level)
+			if gc_was_enabled:
+				gc.enable()
+
+		# Everything below runs after the window
+		timing = self._timing()
+		logger.debug("Fire window voltages: %s", self.raw_voltages)
+		logger.debug("Fire window blocking times: %s us, trigger times: %s us", self.blocking_times_us, self.trigger_times_us)
+		logger.debug("Fire window timing: %s", timing)
+		if self.coilgun.telemetry is not None:
+			self.coilgun.telemetry.publish_voltages(self.voltages)
+			self.coilgun.telemetry.publish_fire(self.velocities, self.trigger_times, self.blocking_times)
+
+		return {
+			'voltages': self.voltages.copy(),
+			'raw_voltages': self.raw_voltages.copy(),
+			'velocities': self.velocities.copy(),
+			'blocking_times_us': self.blocking_times_us.copy(),
+			'trigger_times_us': self.trigger_times_us.copy(),
+			'trigger_times': self.trigger_times.copy(),
+			'efficiencies': self.efficiencies.copy(),
+			'total_efficiency': self.total_efficiency,
+			'timing': timing,
+		}
+
+	def _read_controller_voltages(self, i: int, arduino: Arduino):
+		arduino.send(Arduino.READ_VOLTAGES)
+		parse_ints_into(arduino.read_bytes(), self.raw_voltages, self._offsets[i], self.coilgun.controller_coils[i])
+
+	def _fire_controller(self, i: int, arduino: Arduino):
+		offset = self._offsets[i]
+		count = self.coilgun.controller_coils[i]
+		parse_ints_into(arduino.read_bytes(), self.blocking_times_us, offset, count)
+		parse_ints_into(arduino.read_bytes(), self.trigger_times_us, offset, count)
+
+	def _read_voltages(self):
+		self.coilgun.on_all(self._read_voltages_job)
+		np.take(self.raw_voltages, self._ids, out=self._coil_raw_voltages)
+		np.multiply(self._coil_raw_voltages, self._scale, out=self.voltages)
+
+	def _fire(self):
+		self.coilgun.fire_chain(self._fire_job)
+		self.coilgun.align_trigger_times(self.trigger_times_us)
+		np.multiply(self.blocking_times_us, 1e-6, out=self.blocking_times)
+		np.multiply(self.trigger_times_us, 1e-6, out=self.trigger_times)
+		np.divide(self.coilgun.projectile_dimeter, self.blocking_times, out=self.velocities)
+
+	def _efficiency(self):
+		"""Same as Coilgun.efficiency but vectorized into the preallocated buffers"""
+		# Energy in the CBs
+		np.multiply(self.voltages, self.voltages, out=self.energies)
+		np.multiply(self.energies, self._half_capacitance, out=self.energies)
+
+		# Kinetic energy gained in each coil. The velocity in is the velocity out of the coil before
+		self._v_in[0] = 0
+		self._v_in_tail[:] = self._velocities_head
+		np.multiply(self._v_in, self._v_in, out=self._v_in)
+		np.multiply(self.velocities, self.velocities, out=self._work)
+		np.subtract(self._work, self._v_in, out=self._work)
+		np.multiply(self._work, self._half_mass, out=self._work)
+
+		np.divide(self._work, self.energies, out=self.efficiencies)
+		self.total_efficiency = float(self._half_mass * self.velocities[-1]**2 / self.energies.sum())
+
+	def _timing(self) -> dict:
+		"""Latency of each phase and how much it deviates from the median of earlier shots [us]"""
+		latencies = np.diff(self._stamps) / 1e3
+		history = self._history[:min(self._shots, len(self._history))]
+		if len(history):
+			jitter = latencies - np.median(history, axis=0)
+		else:
+			jitter = np.zeros_like(latencies)
+		self._history[self._shots % len(self._history)] = latencies
+		self._shots += 1
+
+		timing = {f"{phase}_us": float(latency) for phase, latency in zip(FireWindow.PHASES, latencies)}
+		timing.update({f"{phase}_jitter_us": float(j) for phase, j in zip(FireWindow.PHASES, jitter)})
+		timing['window_us'] = float((self._stamps[FireWindow.DONE] - self._stamps[FireWindow.START]) / 1e3)
+		return timing
@@ -0,0 +1,192 @@
+from codec import encode_streams, read_stream_blocks
+import numpy as np
+import logging
+import logging.handlers
+import queue
+import json
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+	"""
+	Queue handler that never blocks the thread that logs.
+	When the bounded queue is full a record is dropped according to 'drop_policy':
+	'newest' drops the incoming record and 'oldest' drops the oldest queued record.
+	'oldest' needs a queue.Queue. The reader of a multiprocessing queue holds its lock
+	while it waits, so the oldest record can't be taken off it. Use a ForwardingQueueHandler
+	to pass the records on to another process
+	"""
+
+	DROP_NEWEST = "newest"
+	DROP_OLDEST = "oldest"
+
+	def __init__(self, log_queue: queue.Queue, drop_policy: str = DROP_OLDEST):
+		if drop_policy not in (self.DROP_NEWEST, self.DROP_OLDEST):
+			raise ValueError(f"Unknown drop policy '{drop_policy}'")
+		if drop_policy == self.DROP_OLDEST and not isinstance(log_queue, queue.Queue):
+			raise ValueError(f"Drop policy '{drop_policy}' needs a queue.Queue")
+		super().__init__(log_queue)
+		self.drop_policy = drop_policy
+		self.dropped = 0
+
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		"""Pass the record on without formatting it. Formatting is left to the listener thread"""
+		if record.exc_info:
+			# Tracebacks can't be sent to another process
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+	def enqueue(self, record: logging.LogRecord):
+		"""Put a record on the queue without ever blocking"""
+		try:
+			self.queue.put_nowait(record)
+			return
+		except queue.Full:
+			pass
+
+		lost = 1
+		if self.drop_policy == self.DROP_OLDEST:
+			try:
+				self.queue.get_nowait()
+			except queue.Empty:
+				# The listener made room in the meantime
+				lost = 0
+			try:
+				self.queue.put_nowait(record)
+			except queue.Full:
+				lost += 1
+		self.dropped += lost
+
+
+class ForwardingQueueHandler(logging.handlers.QueueHandler):
+	"""
+	Pass records that a DroppingQueueHandler has already prepared on to another
+	queue, waiting for room. Used by a listener thread so the thread that logs never waits
+	"""
+
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		return record
+
+	def enqueue(self, record: logging.LogRecord):
+		self.queue.put(record)
+
+
+class JsonLinesHandler(logging.Handler):
+	"""Write structured log records to a file with one JSON object per line"""
+
+	def __init__(self, filename: str, mode: str = 'w'):
+		super().__init__()
+		self.stream = open(filename, mode, encoding='utf-8')
+
+	def emit(self, record: logging.LogRecord):
+		try:
+			entry = {
+				't': record.created,
+				'logger': record.name,
+				'level': record.levelname,
+				'msg': record.msg if isinstance(record.msg, str) else str(record.msg),
+				'args': record.args,
+			}
+			if record.exc_info:
+				entry['exc'] = logging.Formatter().formatException(record.exc_info)
+			elif record.exc_text:
+				entry['exc'] = record.exc_text
+			self.stream.write(json.dumps(entry, default=_to_json) + '\n')
+		except Exception:
+			self.handleError(record)
+
+	def flush(self):
+		self.acquire()
+		try:
+			self.stream.flush()
+		finally:
+			self.release()
+
+	def close(self):
+		self.acquire()
+		try:
+			self.stream.close()
+		finally:
+			self.release()
+		super().close()
+
+
+class AdcStreamHandler(logging.Handler):
+	"""
+	Write the ADC readings that records carry in an 'adc' attribute to a file
+	encoded with codec.py instead of as JSON text. Readings are buffered and
+	written as one block of streams every 'block_size' records. Read the file with read_adc_log
+	"""
+
+	def __init__(self, filename: str, mode: str = 'w', block_size: int = 1000):
+		super().__init__()
+		self.addFilter(is_adc_record)
+		self.stream = open(filename, mode + 'b')
+		self.block_size = block_size
+		self.times_us = []
+		self.readings = []
+
+	def emit(self, record: logging.LogRecord):
+		try:
+			self.times_us.append(round(record.created * 1e6))
+			self.readings.append(record.adc)
+			if len(self.times_us) >= self.block_size:
+				self._write_block()
+		except Exception:
+			self.handleError(record)
+
+	def _write_block(self):
+		if not self.times_us:
+			return
+		# One series per ADC channel so the deltas are between readings in time
+		readings = np.array(self.readings, dtype=np.int64).T
+		self.stream.write(encode_streams({'time_us': np.array(self.times_us, dtype=np.int64), 'adc': readings}))
+		self.times_us = []
+		self.readings = []
+
+	def flush(self):
+		self.acquire()
+		try:
+			self._write_block()
+			self.stream.flush()
+		finally:
+			self.release()
+
+	def close(self):
+		self.acquire()
+		try:
+			self._write_block()
+			self.stream.close()
+		finally:
+			self.release()
+		super().close()
+
+
+def is_adc_record(record: logging.LogRecord) -> bool:
+	return hasattr(record, 'adc')
+
+
+def read_adc_log(filename: str) -> tuple[np.ndarray, np.ndarray]:
+	"""POSIX times [s] and (readings, channels) ADC values written by an AdcStreamHandler"""
+	times = []
+	readings = []
+	for block in read_stream_blocks(filename):
+		times.append(block['time_us'] * 1e-6)
+		readings.append(block['adc'].reshape(-1, len(block['time_us'])).T)
+	if not times:
+		return np.zeros(0), np.zeros((0, 0), dtype=np.int64)
+	return np.concatenate(times), np.concatenate(readings)
+
+
+class BlockingStopQueueListener(logging.handlers.QueueListener):
+	"""Queue listener that waits for room in a full queue when it is stopped"""
+
+	def enqueue_sentinel(self):
+		self.queue.put(self._sentinel)
+
+
+def _to_json(obj):
+	"""Convert objects that json can't handle (NumPy arrays and scalars etc.)"""
+	if hasattr(obj, 'tolist'):
+		return obj.tolist()
+	return str(obj)
@@ -0,0 +1,200 @@
+import hashlib
+import marshal
+import re
+import os
+
+
+class RigConfigError(Exception):
+	pass
+
+
+class Rig:
+	"""Validated rig configuration (projectile, controllers and coils)"""
+
+	# Bump when the compiled form changes so old caches are ignored
+	CACHE_VERSION = 3
+
+	COIL_KEYS = {
+		# key: (type, default). Keys without a default are required
+		'capacitance': (float, None),			# Total capacitance in the capacitance bank [F]
+		'R1': (float, None), 					# First resistance in the voltage divider [ohm]
+		'R2': (float, None), 					# Second resistance in the voltage divider [ohm]
+		'state': (bool, None), 					# Is the coil ON or OFF
+		'windings': (int, 0), 					# Number of windings on the coil
+		'position': (float, 0.0), 				# Position relative sensor (end of sensor to start of coil) [mm]
+		'resistor_tolerance': (float, 0.01), 	# Relative tolerance of R1 and R2
+		'capacitance_tolerance': (float, 0.1), 	# Relative tolerance of the capacitance
+	}
+	POSITIVE_COIL_KEYS = ('capacitance', 'R1', 'R2')
+	TOLERANCE_COIL_KEYS = ('resistor_tolerance', 'capacitance_tolerance')
+
+	ARDUINO_DEFAULTS = {
+		'timer_resolution': 4e-6, 			# Resolution of micros() [s]
+		'adc_reference_tolerance': 0.01, 	# Relative error of the 5 V ADC reference
+	}
+
+	def __init__(self, compiled: dict):
+		self.projectile_diameter = compiled['projectile_diameter']
+		self.projectile_mass = compiled['projectile_mass']
+		self.baudrate = compiled['baudrate']
+		self.timeout = compiled['timeout']
+		self.timer_resolution = compiled['timer_resolution']
+		self.adc_reference_tolerance = compiled['adc_reference_tolerance']
+		# (port, number of coils) in the order the projectile passes them
+		self.controllers = [tuple(controller) for controller in compiled['controllers']]
+		# Coil dicts sorted by name (coil1, coil2, ..., coil10)
+		self.coils = compiled['coils']
+
+	@property
+	def windings(self) -> list[int]:
+		return [coil['windings'] for coil in self.coils]
+
+	@property
+	def positions(self) -> list[float]:
+		return [coil['position'] for coil in self.coils]
+
+	@staticmethod
+	def compile(raw: dict) -> dict:
+		"""Validate a parsed rig file and convert it to plain values"""
+		if not isinstance(raw, dict):
+			raise RigConfigError("The rig file must be a mapping")
+		for section in ('projectile', 'arduino', 'coils'):
+			if not isinstance(raw.get(section), dict):
+				raise RigConfigError(f"Missing section '{section}'")
+
+		projectile = raw['projectile']
+		arduino = raw['arduino']
+		compiled = {
+			'projectile_diameter': _number(projectile, 'diameter', 'projectile', positive=True),
+			'projectile_mass': _number(projectile, 'mass', 'projectile', positive=True),
+			'baudrate': int(_number(arduino, 'baudrate', 'arduino', positive=True)),
+			'timeout': _number(arduino, 'timeout', 'arduino', positive=True),
+		}
+		if 'timer_resolution' in arduino:
+			compiled['timer_resolution'] = _number(arduino, 'timer_resolution', 'arduino', positive=True)
+		else:
+			compiled['timer_resolution'] = Rig.ARDUINO_DEFAULTS['timer_resolution']
+		compiled['adc_reference_tolerance'] = _tolerance(arduino, 'adc_reference_tolerance', 'arduino', Rig.ARDUINO_DEFAULTS['adc_reference_tolerance'])
+
+		coils = []
+		for name in sorted(raw['coils'].keys(), key=_natural_key):
+			coil = raw['coils'][name]
+			if not isinstance(coil, dict):
+				raise RigConfigError(f"Coil '{name}' must be a mapping")
+			unknown = set(coil) - set(Rig.COIL_KEYS)
+			if unknown:
+				raise RigConfigError(f"Unknown keys for coil '{name}': {sorted(unknown)}")
+			compiled_coil = {}
+			for key, (key_type, default) in Rig.COIL_KEYS.items():
+				if key in Rig.TOLERANCE_COIL_KEYS:
+					compiled_coil[key] = _tolerance(coil, key, name, default)
+				elif key not in coil:
+					if default is None:
+						raise RigConfigError(f"Coil '{name}' is missing '{key}'")
+					compiled_coil[key] = default
+				elif key_type is bool:
+					if not isinstance(coil[key], bool):
+						raise RigConfigError(f"'{key}' for coil '{name}' must be ON or OFF")
+					compiled_coil[key] = coil[key]
+				else:
+					compiled_coil[key] = key_type(_number(coil, key, name, positive=key in Rig.POSITIVE_COIL_KEYS))
+			coils.append(compiled_coil)
+		if not coils:
+			raise RigConfigError("No coils in the rig file")
+		compiled['coils'] = coils
+
+		controllers = arduino.get('controllers')
+		if controllers is None:
+			controllers = [{'port': arduino.get('port'), 'coils': len(coils)}]
+		if not isinstance(controllers, list) or not controllers:
+			raise RigConfigError("'controllers' must be a list")
+		compiled['controllers'] = []
+		for controller in controllers:
+			if not isinstance(controller, dict) or not isinstance(controller.get('port'), str):
+				raise RigConfigError(f"Controller {controller} must have a 'port'")
+			compiled['controllers'].append((controller['port'], int(_number(controller, 'coils', 'controller', positive=True))))
+		if sum(n for _, n in compiled['controllers']) != len(coils):
+			raise RigConfigError(f"The controllers have room for {sum(n for _, n in compiled['controllers'])} coils but there are {len(coils)}")
+
+		return compiled
+
+
+def load_rig(path: str = "coils.yaml") -> Rig:
+	"""
+	Load the rig file. The validated rig is cached next to the file and reused
+	while the file's mtime and size (or, if they changed, its hash) are the same
+	"""
+	cache_path = path + ".cache"
+	stat = os.stat(path)
+
+	cache = _read_cache(cache_path)
+	if cache is not None and cache['mtime_ns'] == stat.st_mtime_ns and cache['size'] == stat.st_size:
+		return Rig(cache['rig'])
+
+	with open(path, 'rb') as rig_file:
+		content = rig_file.read()
+	digest = hashlib.sha256(content).hexdigest()
+
+	if cache is not None and cache['sha256'] == digest:
+		# Touched but not changed
+		compiled = cache['rig']
+	else:
+		# Only import yaml when the file actually has to be parsed
+		import yaml
+		compiled = Rig.compile(yaml.safe_load(content))
+
+	_write_cache(cache_path, {
+		'version': Rig.CACHE_VERSION,
+		'mtime_ns': stat.st_mtime_ns,
+		'size': stat.st_size,
+		'sha256': digest,
+		'rig': compiled,
+	})
+	return Rig(compiled)
+
+
+def _natural_key(name: str) -> list:
+	"""Sort key that orders numbers in names by value, so coil10 comes after coil9"""
+	return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', str(name))]
+
+
+def _number(section: dict, key: str, name: str, positive: bool = False) -> float:
+	value = section.get(key)
+	if isinstance(value, bool) or not isinstance(value, (int, float)):
+		raise RigConfigError(f"'{key}' for '{name}' must be a number, got {value!r}")
+	if positive and value <= 0:
+		raise RigConfigError(f"'{key}' for '{name}' must be positive, got {value}")
+	return float(value)
+
+
+def _tolerance(section: dict, key: str, name: str, default: float) -> float:
+	"""Relative tolerance between 0 and 1. The default is used if the key is missing"""
+	if key not in section:
+		return default
+	value = _number(section, key, name)
+	if not 0 <= value < 1:
+		raise RigConfigError(f"'{key}' for '{name}' must be at least 0 and below 1, got {value}")
+	return value
+
+
+def _read_cache(cache_path: str) -> dict | None:
+	try:
+		with open(cache_path, 'rb') as cache_file:
+			cache = marshal.load(cache_file)
+	except (OSError, EOFError, ValueError, TypeError):
+		return None
+	if not isinstance(cache, dict) or cache.get('version') != Rig.CACHE_VERSION:
+		return None
+	return cache
+
+
+def _write_cache(cache_path: str, cache: dict):
+	# Write to a temporary file first so a crash never leaves half a cache
+	tmp_path = cache_path + ".tmp"
+	try:
+		with open(tmp_path, 'wb') as cache_file:
+			marshal.dump(cache, cache_file)
+		os.replace(tmp_path, cache_path)
+	except OSError:
+		# A read only checkout still works, just without the cache
+		pass
@@ -0,0 +1,68 @@
+"""
+Reading the shot logs written by fire.log_shot
+"""
+from datetime import datetime
+import numpy as np
+import glob
+import os
+
+
+# Dataset name: CSV column
+COLUMNS = {
+	'velocities': 'Velocities [m/s]',
+	'voltages': 'Voltages [V]',
+	'efficiencies': 'Efficiency [%]',
+	'windings': 'Windings [-]',
+	'positions': 'Positions [mm]',
+	'trigger_times': 'Trigger times [s]',
+}
+
+# Time stamp in the file names
+TIME_FORMAT = '%d-%m-%Y %H-%M-%S'
+
+
+def find_logs(paths: list[str]) -> list[str]:
+	"""Expand directories to the CSV files in them (recursively)"""
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			files += sorted(glob.glob(os.path.join(path, '**', '*.csv'), recursive=True))
+		else:
+			files.append(path)
+	return files
+
+
+def log_time(filename: str) -> float:
+	"""POSIX time of a shot from its file name. nan if the name has no time stamp"""
+	stem = os.path.splitext(os.path.basename(filename))[0]
+	try:
+		return datetime.strptime(stem.split('_', 1)[-1], TIME_FORMAT).timestamp()
+	except ValueError:
+		return np.nan
+
+
+def load_logs(paths: list[str], columns: list[str] = tuple(COLUMNS)) -> tuple[list[str], dict, int]:
+	"""
+	Read shot logs. Shots with fewer coils are padded with nan.
+	Return the files that could be read, a (shots, coils) array for each column
+	and the number of files that were skipped because they are not shot logs
+	"""
+	import pandas as pd
+
+	read = []
+	shots = []
+	skipped = 0
+	for filename in find_logs(paths):
+		try:
+			shot = pd.read_csv(filename, index_col=0)
+			shots.append(shot[[COLUMNS[column] for column in columns]].to_numpy(dtype=np.float64))
+			read.append(filename)
+		except (ValueError, KeyError, pd.errors.ParserError):
+			# Logs that have been reformatted for MATLAB have no header
+			skipped += 1
+
+	coils = max((len(shot) for shot in shots), default=0)
+	data = np.full((len(shots), coils, len(columns)), np.nan)
+	for i, shot in enumerate(shots):
+		data[i, :len(shot)] = shot
+	return read, {column: data[..., i] for i, column in enumerate(columns)}, skipped
@@ -0,0 +1,146 @@
+"""
+Soak test: run thousands of simulated charge/fire/drain cycles against a fake
+serial endpoint and report memory growth, logger handler accumulation and
+latency drift over time. Exits with 1 if a threshold is exceeded
+"""
+from coilgun import Coil, Coilgun
+from fake_serial import fake_arduino
+import numpy as np
+import tracemalloc
+import argparse
+import logging
+import time
+import sys
+
+
+PHASES = ('charge', 'fire', 'drain')
+
+# Histogram bucket edges [us]
+HISTOGRAM_EDGES = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000]
+
+
+def cycle(coilgun: Coilgun, max_voltage: float, latencies: dict):
+	"""One charge/fire/drain cycle. Latencies are appended in microseconds"""
+	t0 = time.perf_counter_ns()
+	coilgun.CHARGE_COILGUN([max_voltage] * len(coilgun))
+	t1 = time.perf_counter_ns()
+
+	fire_voltages = coilgun.READ_VOLTAGES()
+	velocities, trigger_times = coilgun.FIRE()
+	coilgun.efficiency(fire_voltages, velocities)
+	t2 = time.perf_counter_ns()
+
+	after_fire_voltages = np.array(coilgun.READ_VOLTAGES())
+	coilgun.DRAIN_CB(after_fire_voltages < coilgun.MAX_VOLTAGE_FOR_SAFE_DRAIN)
+	coilgun.OFF()
+	t3 = time.perf_counter_ns()
+
+	latencies['charge'].append((t1 - t0) / 1e3)
+	latencies['fire'].append((t2 - t1) / 1e3)
+	latencies['drain'].append((t3 - t2) / 1e3)
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+	"""Snapshot without the allocations made by tracemalloc itself and by imports"""
+	return tracemalloc.take_snapshot().filter_traces([
+		tracemalloc.Filter(False, tracemalloc.__file__),
+		tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+		tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+	])
+
+
+def histogram(samples: list[float]) -> str:
+	"""Compact text histogram of latencies"""
+	counts = np.histogram(samples, bins=[0] + HISTOGRAM_EDGES + [np.inf])[0]
+	labels = [f"<{e}" for e in HISTOGRAM_EDGES] + [f">={HISTOGRAM_EDGES[-1]}"]
+	return ' '.join(f"{label}:{count}" for label, count in zip(labels, counts) if count)
+
+
+def soak(
+	cycles: int,
+	window: int,
+	coils: int,
+	rebuild_every: int,
+	max_memory_growth: float, 		# [KiB]
+	max_p99_drift: float, 			# Allowed ratio between the p99 of the last and first window
+	max_voltage: float = 100
+) -> bool:
+	"""Run the soak test. Return True if all thresholds hold"""
+	coil_list = [Coil(capacitance=1067e-6, R1=22e6, R2=82e3, state=True) for _ in range(coils)]
+	coil_logger = logging.getLogger('Coilgun')
+	arduino = fake_arduino(coils, seed=0)
+
+	tracemalloc.start()
+	coilgun = Coilgun(coil_list, arduino, 16e-3, 2.3e-3)
+	latencies = {phase: [] for phase in PHASES}
+
+	# Memory growth is measured from the end of the first window so
+	# warm up (caches and lazy imports) doesn't count as growth
+	baseline = None
+	baseline_handlers = len(coil_logger.handlers)
+	first_p99 = None
+	passed = True
+
+	print(f"{'cycles':>8} {'memory [KiB]':>13} {'handlers':>9} " + ' '.join(f"{p + ' p99 [us]':>16}" for p in PHASES))
+	for i in range(1, cycles + 1):
+		if rebuild_every and i % rebuild_every == 0:
+			# Reconnect the way fire.py would, with the default logger
+			coilgun = Coilgun(coil_list, arduino, 16e-3, 2.3e-3)
+		cycle(coilgun, max_voltage, latencies)
+
+		if i % window == 0 or i == cycles:
+			p99 = {phase: float(np.percentile(latencies[phase], 99)) for phase in PHASES}
+			histograms = {phase: histogram(latencies[phase]) for phase in PHASES}
+			latencies = {phase: [] for phase in PHASES}
+			if first_p99 is None:
+				first_p99 = p99
+
+			snapshot = take_snapshot()
+			if baseline is None:
+				baseline = snapshot
+			growth = sum(stat.size_diff for stat in snapshot.compare_to(baseline, 'filename')) / 1024
+			handlers = len(coil_logger.handlers)
+
+			print(f"{i:>8} {growth:>13.1f} {handlers:>9} " + ' '.join(f"{p99[p]:>16.0f}" for p in PHASES))
+			for phase in PHASES:
+				print(f"{'':>8} {phase}: {histograms[phase]}")
+
+	tracemalloc.stop()
+
+	if growth > max_memory_growth:
+		print(f"FAIL: memory grew by {growth:.1f} KiB (limit {max_memory_growth} KiB)")
+		for stat in snapshot.compare_to(baseline, 'lineno')[:5]:
+			print(f"  {stat}")
+		passed = False
+	if handlers > baseline_handlers:
+		print(f"FAIL: the 'Coilgun' logger went from {baseline_handlers} to {handlers} handlers")
+		passed = False
+	for phase in PHASES:
+		drift = p99[phase] / first_p99[phase]
+		if drift > max_p99_drift:
+			print(f"FAIL: {phase} p99 drifted by a factor {drift:.2f} (limit {max_p99_drift})")
+			passed = False
+	if passed:
+		print("PASS")
+	return passed
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--cycles', type=int, default=5000)
+	parser.add_argument('--window', type=int, default=500, help="Cycles between reports")
+	parser.add_argument('--coils', type=int, default=8)
+	parser.add_argument('--rebuild-every', type=int, default=100, help="Cycles between recreating the Coilgun (0 to never)")
+	parser.add_argument('--max-memory-growth', type=float, default=256, help="[KiB]")
+	parser.add_argument('--max-p99-drift', type=float, default=1.5)
+	args = parser.parse_args()
+
+	passed = soak(
+		args.cycles, args.window, args.coils, args.rebuild_every,
+		args.max_memory_growth, args.max_p99_drift
+	)
+	sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,205 @@
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import time
+import os
+
+
+# Kinds of samples on the bus
+VOLTAGES = 1 	# values[0] = voltages [V]
+FIRE = 2 		# values[0] = velocities [m/s], values[1] = trigger times [s], values[2] = blocking times [s]
+
+MAGIC = 0x434F494C 	# 'COIL'
+VERSION = 2
+
+HEADER = np.dtype([
+	('magic', '<u4'),
+	('version', '<u4'),
+	('coils', '<u4'),
+	('capacity', '<u4'),
+	('pid', '<u4'), 		# Process that publishes to the ring
+	('pad', '<u4'),
+	('head', '<u8'), 		# Number of samples published so far
+])
+
+
+class TelemetryBusError(Exception):
+	pass
+
+
+def slot_dtype(coils: int) -> np.dtype:
+	"""Layout of one slot in the ring"""
+	return np.dtype([
+		# Seqlock: odd while the slot is being written, 2 * (index + 1) when sample 'index' is complete
+		('seq', '<u8'),
+		('kind', '<u4'),
+		('pad', '<u4'),
+		('time', '<f8'),
+		('values', '<f8', (3, coils)),
+	])
+
+
+def _layout(buf, coils: int, capacity: int) -> tuple[np.ndarray, np.ndarray]:
+	"""Map the header and the slots on a shared memory buffer"""
+	header = np.ndarray((1,), dtype=HEADER, buffer=buf)
+	slots = np.ndarray((capacity,), dtype=slot_dtype(coils), buffer=buf, offset=HEADER.itemsize)
+	return header, slots
+
+
+class TelemetryPublisher:
+	"""
+	Publish voltage readings and fire results to a shared memory ring.
+	Only the process that owns the Arduino should publish
+	"""
+
+	def __init__(self, name: str, coils: int, capacity: int = 4096):
+		size = HEADER.itemsize + capacity * slot_dtype(coils).itemsize
+		try:
+			self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+		except FileExistsError:
+			_remove_stale(name)
+			self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+		self.coils = coils
+		self.capacity = capacity
+		self.header, self.slots = _layout(self.shm.buf, coils, capacity)
+		self.header[0] = (MAGIC, VERSION, coils, capacity, os.getpid(), 0, 0)
+		self.slots['seq'] = 0
+
+	def publish(self, kind: int, *rows):
+		"""Publish a sample with up to three rows of one value per coil"""
+		index = int(self.header['head'][0])
+		slot = self.slots[index % self.capacity:index % self.capacity + 1]
+
+		slot['seq'] = 2 * index + 1
+		slot['kind'] = kind
+		slot['time'] = time.time()
+		values = slot['values'][0]
+		values[:] = np.nan
+		for row, data in zip(values, rows):
+			n = min(len(data), self.coils)
+			row[:n] = data[:n]
+		slot['seq'] = 2 * index + 2
+
+		self.header['head'] = index + 1
+
+	def publish_voltages(self, voltages):
+		self.publish(VOLTAGES, voltages)
+
+	def publish_fire(self, velocities, trigger_times, blocking_times):
+		self.publish(FIRE, velocities, trigger_times, blocking_times)
+
+	def close(self):
+		"""Remove the ring"""
+		del self.header, self.slots
+		self.shm.close()
+		self.shm.unlink()
+
+
+def _remove_stale(name: str):
+	"""
+	Remove a ring left behind by a process that did not shut down cleanly.
+	Raise TelemetryBusError if the ring is still in use or is not a telemetry ring
+	"""
+	existing = shared_memory.SharedMemory(name=name)
+	header = None
+	if existing.size >= HEADER.itemsize:
+		header = np.ndarray((1,), dtype=HEADER, buffer=existing.buf).copy()
+	existing.close()
+
+	error = None
+	if header is None or header['magic'][0] != MAGIC:
+		error = f"Shared memory '{name}' exists and is not a telemetry ring"
+	elif header['version'][0] != VERSION:
+		error = f"Shared memory '{name}' is a telemetry ring from another version. Remove /dev/shm/{name} if it is not in use"
+	elif _is_running(int(header['pid'][0])):
+		error = f"Telemetry ring '{name}' is in use by process {header['pid'][0]}. Is the coilgun already running?"
+	if error is not None:
+		# Attaching registered the ring with this process' resource tracker (Python < 3.13), which would remove it at exit
+		_unregister(existing)
+		raise TelemetryBusError(error)
+	existing.unlink()
+
+
+def _unregister(shm: shared_memory.SharedMemory):
+	try:
+		resource_tracker.unregister(shm._name, 'shared_memory')
+	except Exception:
+		pass
+
+
+def _is_running(pid: int) -> bool:
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		# Running as another user
+		return True
+	return True
+
+
+class TelemetryReader:
+	"""Read only view of a telemetry ring published by another process"""
+
+	def __init__(self, name: str):
+		self.shm = shared_memory.SharedMemory(name=name)
+		# Python < 3.13 registers attached segments too and would remove the ring when this process exits
+		_unregister(self.shm)
+
+		header = np.ndarray((1,), dtype=HEADER, buffer=self.shm.buf)
+		if header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+			self.shm.close()
+			raise ValueError(f"Shared memory '{name}' is not a telemetry ring")
+
+		self.coils = int(header['coils'][0])
+		self.capacity = int(header['capacity'][0])
+		self.header, self.slots = _layout(self.shm.buf, self.coils, self.capacity)
+		self.header.flags.writeable = False
+		self.slots.flags.writeable = False
+
+	@property
+	def head(self) -> int:
+		"""Number of samples published so far"""
+		return int(self.header['head'][0])
+
+	def read(self, index: int) -> np.void | None:
+		"""
+		Read sample number 'index'.
+		Return None if it has not been published yet or has already been overwritten
+		"""
+		slot = self.slots[index % self.capacity]
+		expected = 2 * index + 2
+		if slot['seq'] != expected:
+			return None
+		sample = slot.copy()
+		if slot['seq'] != expected:
+			# Overwritten while copying
+			return None
+		return sample
+
+	def latest(self, kind: int = None) -> np.void | None:
+		"""Get the newest complete sample (of a kind)"""
+		head = self.head
+		for index in range(head - 1, max(head - self.capacity, 0) - 1, -1):
+			sample = self.read(index)
+			if sample is not None and (kind is None or sample['kind'] == kind):
+				return sample
+		return None
+
+	def since(self, index: int) -> tuple[list[np.void], int]:
+		"""
+		Get all samples published from sample 'index'.
+		Return the samples and the index to continue from
+		"""
+		head = self.head
+		index = max(index, head - self.capacity)
+		samples = []
+		for i in range(index, head):
+			sample = self.read(i)
+			if sample is not None:
+				samples.append(sample)
+		return samples, head
+
+	def close(self):
+		del self.header, self.slots
+		self.shm.close()
@@ -1,7 +1,7 @@
 from communication import Arduino
 from coilgun import Coil, Coilgun
+from rig import load_rig
 import config
-import yaml
 import time
 import logging
 from utils import print_data
@@ -19,20 +19,17 @@ def test_decorator(func):
 
 
 def test_coilgun():
-	arduino = Arduino(config.port, config.baudrate, config.timeout)
+	rig = load_rig(config.rig_file)
+	arduinos = [Arduino(port, rig.baudrate, rig.timeout) for port, _ in rig.controllers]
 
 	print("Testing communication with the Arduino...")
-	if not arduino.connect():
-		print("Failed to connect to the Arduino.")
-		print("Quiting...")
+	for arduino in arduinos:
+		if not arduino.connect():
+			print(f"Failed to connect to the Arduino on {arduino.port}.")
+			print("Quiting...")
 	print("Communication sucessfull!")
 
-	with open("coils.yaml", "r") as yaml_file:
-		coils_dict = yaml.safe_load(yaml_file)
-
-	sorted_coils = sorted(coils_dict.keys())
-
-	coils = [Coil.from_dict(coils_dict[coil]) for coil in sorted_coils]
+	coils = [Coil.from_dict(coil_dict) for coil_dict in rig.coils]
 
 	# Create a logger
 	logger = logging.getLogger('Coilgun')
@@ -45,7 +42,10 @@ def test_coilgun():
 	logger.setLevel(logging.DEBUG)
 
 	
-	coilgun = Coilgun(coils, arduino, config.projectile_diameter, config.projectile_mass, logger=logger)
+	coilgun = Coilgun(
+		coils, arduinos, rig.projectile_diameter, rig.projectile_mass,
+		logger=logger, controller_coils=[n for _, n in rig.controllers]
+	)
 
 	# Turn ON all coils so they can be tested
 	# for coil in coilgun:
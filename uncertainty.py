@@ -0,0 +1,225 @@
+"""
+Monte Carlo uncertainty of logged shots. The raw readings (ADC values and
+blocking times in microseconds) are recovered from the logged voltages and
+velocities and perturbed by the timer resolution, ADC quantization and the
+tolerances of the ADC reference, voltage dividers and CBs from the rig file.
+All shots and samples in a batch are computed at once with NumPy.
+Shots that are physically impossible even at the edges of their confidence
+intervals are flagged
+"""
+from rig import load_rig, Rig
+from shot_logs import load_logs
+import config
+import numpy as np
+import argparse
+import time
+
+
+# Flags for impossible shots
+INFINITE_VELOCITY = "infinite velocity" 		# A sensor was never blocked
+OVER_UNITY = "over unity" 						# A coil gave the projectile more energy than its CB held
+LOSS_ABOVE_CB_ENERGY = "loss above CB energy" 	# The projectile lost more energy than the CB held, so the coil can't be the cause
+TRIGGER_ORDER = "trigger order" 				# Sensors were passed out of order
+
+ADC_MAX = 1023
+ADC_REFERENCE = 5 	# [V]
+
+# Largest number of samples (shots * coils * samples) computed at once
+BATCH_SIZE = 4_000_000
+
+
+def divider_scale(R1: np.ndarray, R2: np.ndarray, reference: float | np.ndarray = ADC_REFERENCE) -> np.ndarray:
+	"""Volts in the CB per ADC step"""
+	return reference / ADC_MAX * (R1 + R2) / R2
+
+
+def simulate(
+	velocities: np.ndarray, 		# (shots, coils) [m/s], nan for coils without data
+	voltages: np.ndarray, 			# (shots, coils) [V]
+	rig: Rig,
+	trigger_times: np.ndarray = None, # (shots, coils) [s]
+	samples: int = config.uncertainty_samples,
+	confidence: float = config.uncertainty_confidence,
+	seed: int = None
+) -> dict:
+	"""
+	Confidence intervals for the velocities, voltages and efficiencies of each
+	shot and flags for the impossible ones. Intervals have the shape (..., 2).
+	'missing' marks the coils without data
+	"""
+	velocities = np.asarray(velocities, dtype=np.float64)
+	voltages = np.asarray(voltages, dtype=np.float64)
+	shots, coils = velocities.shape
+	if coils > len(rig.coils):
+		raise ValueError(f"The shots have {coils} coils but the rig only has {len(rig.coils)}")
+
+	capacitance = np.array([coil['capacitance'] for coil in rig.coils[:coils]])
+	R1 = np.array([coil['R1'] for coil in rig.coils[:coils]])
+	R2 = np.array([coil['R2'] for coil in rig.coils[:coils]])
+	resistor_tolerance = np.array([coil['resistor_tolerance'] for coil in rig.coils[:coils]])
+	capacitance_tolerance = np.array([coil['capacitance_tolerance'] for coil in rig.coils[:coils]])
+	diameter = rig.projectile_diameter
+	mass = rig.projectile_mass
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		# Raw readings. An infinite velocity means the sensor was blocked for 0 us
+		missing = np.isnan(velocities)
+		blocking_us = np.where(missing, 0, np.rint(diameter / velocities * 1e6))
+		raw_voltages = np.where(np.isnan(voltages), 0, np.rint(voltages / divider_scale(R1, R2)))
+
+	# Sensors after the last blocked one were never reached (or not mounted), so they have no data.
+	# An unblocked sensor before a blocked one missed the projectile
+	unblocked = (blocking_us == 0) & ~missing
+	reached = np.arange(coils) <= _last_measured(missing | unblocked)[:, None]
+	reached[(missing | unblocked).all(axis=1)] = True
+	missing |= ~reached
+	unblocked &= reached
+
+	quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+	result = {
+		'velocity': np.empty((shots, coils, 2)),
+		'voltage': np.empty((shots, coils, 2)),
+		'efficiency': np.empty((shots, coils, 2)),
+		'total_efficiency': np.empty((shots, 2)),
+	}
+
+	rng = np.random.default_rng(seed)
+	batch = max(1, BATCH_SIZE // (coils * samples))
+	for start in range(0, shots, batch):
+		stop = min(start + batch, shots)
+		batch_result = _simulate_batch(
+			blocking_us[start:stop], raw_voltages[start:stop], missing[start:stop],
+			capacitance, R1, R2, resistor_tolerance, capacitance_tolerance,
+			rig.timer_resolution, rig.adc_reference_tolerance, diameter, mass, samples, quantiles, rng
+		)
+		for key, interval in batch_result.items():
+			result[key][start:stop] = interval
+
+	result['velocity'][unblocked] = np.inf
+	result['missing'] = missing
+	result['flags'] = _flags(result, unblocked, missing, trigger_times)
+	return result
+
+
+def _simulate_batch(
+	blocking_us, raw_voltages, missing, capacitance, R1, R2, resistor_tolerance, capacitance_tolerance,
+	timer_resolution, adc_reference_tolerance, diameter, mass, samples, quantiles, rng
+) -> dict:
+	"""Monte Carlo for a batch of shots. Samples are along the last axis"""
+	shots, coils = blocking_us.shape
+	shape = (shots, coils, samples)
+
+	def spread(tolerance: float | np.ndarray, size) -> np.ndarray:
+		return 1 + tolerance * rng.uniform(-1, 1, size)
+
+	# Both ends of the blocking time are rounded to the timer resolution,
+	# so the error of the difference is triangular
+	timer_error = timer_resolution * (rng.random(shape) - rng.random(shape))
+	blocking_times = np.abs(blocking_us[..., None] * 1e-6 + timer_error)
+
+	# Quantization is half an ADC step (a reading of 0 is between 0 and half a step).
+	# Tolerances are the same for all shots in a sample
+	raw = np.abs(raw_voltages[..., None] + rng.uniform(-0.5, 0.5, shape))
+	reference = ADC_REFERENCE * spread(adc_reference_tolerance, samples)
+	R1_samples = R1[:, None] * spread(resistor_tolerance[:, None], (coils, samples))
+	R2_samples = R2[:, None] * spread(resistor_tolerance[:, None], (coils, samples))
+	capacitance_samples = capacitance[:, None] * spread(capacitance_tolerance[:, None], (coils, samples))
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		voltages = raw * divider_scale(R1_samples, R2_samples, reference)
+		velocities = np.where((blocking_us > 0)[..., None], diameter / blocking_times, np.inf)
+		velocities[missing] = np.nan
+
+		# Same as Coilgun.efficiency for every sample
+		energies = np.where(missing[..., None], 0, capacitance_samples * voltages**2 / 2)
+		v_in = np.zeros_like(velocities)
+		v_in[:, 1:] = velocities[:, :-1]
+		efficiencies = mass * (velocities**2 - v_in**2) / 2 / energies
+		last_velocity = np.take_along_axis(velocities, _last_measured(missing)[:, None, None], axis=1)[:, 0]
+		total_efficiencies = mass * last_velocity**2 / 2 / energies.sum(axis=1)
+
+		return {
+			'velocity': np.moveaxis(np.quantile(velocities, quantiles, axis=-1), 0, -1),
+			'voltage': np.moveaxis(np.quantile(voltages, quantiles, axis=-1), 0, -1),
+			'efficiency': np.moveaxis(np.quantile(efficiencies, quantiles, axis=-1), 0, -1),
+			'total_efficiency': np.moveaxis(np.quantile(total_efficiencies, quantiles, axis=-1), 0, -1),
+		}
+
+
+def _last_measured(missing: np.ndarray) -> np.ndarray:
+	"""Index of the last coil with data in each shot (the last coil if none have data)"""
+	coils = missing.shape[1]
+	return coils - 1 - np.argmax(~missing[:, ::-1], axis=1)
+
+
+def _flags(result: dict, unblocked: np.ndarray, missing: np.ndarray, trigger_times: np.ndarray | None) -> list[list[str]]:
+	"""Flag the shots that are impossible within their confidence intervals"""
+	efficiency = result['efficiency']
+	coil_flags = {
+		INFINITE_VELOCITY: unblocked,
+		OVER_UNITY: efficiency[..., 0] > 1,
+		LOSS_ABOVE_CB_ENERGY: efficiency[..., 1] < -1,
+	}
+	if trigger_times is not None:
+		# Each sensor is passed after the one before it
+		out_of_order = np.zeros_like(missing)
+		with np.errstate(invalid='ignore'):
+			out_of_order[:, 1:] = np.diff(trigger_times, axis=1) <= 0
+		coil_flags[TRIGGER_ORDER] = out_of_order & ~missing
+
+	flags = []
+	for shot in range(len(missing)):
+		shot_flags = []
+		for flag, coils in coil_flags.items():
+			flagged = np.flatnonzero(coils[shot])
+			if len(flagged):
+				shot_flags.append(f"{flag} (coil {', '.join(str(i + 1) for i in flagged)})")
+		if result['total_efficiency'][shot, 0] > 1:
+			shot_flags.append(f"{OVER_UNITY} (total)")
+		flags.append(shot_flags)
+	return flags
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('paths', nargs='*', default=['data_loggs'], help="Shot logs or directories with shot logs")
+	parser.add_argument('--rig', default=config.rig_file)
+	parser.add_argument('--samples', type=int, default=config.uncertainty_samples)
+	parser.add_argument('--confidence', type=float, default=config.uncertainty_confidence)
+	parser.add_argument('--seed', type=int)
+	parser.add_argument('--all', action='store_true', help="Show all shots, not only the flagged ones")
+	args = parser.parse_args()
+
+	rig = load_rig(args.rig)
+	files, logs, skipped = load_logs(args.paths, ['velocities', 'voltages', 'trigger_times'])
+	if skipped:
+		print(f"Skipped {skipped} files that are not shot logs")
+	velocities, voltages, trigger_times = logs['velocities'], logs['voltages'], logs['trigger_times']
+
+	start = time.perf_counter()
+	result = simulate(velocities, voltages, rig, trigger_times, args.samples, args.confidence, args.seed)
+	elapsed = time.perf_counter() - start
+
+	percent = f"{args.confidence * 100:g}%"
+	flagged = 0
+	for i, filename in enumerate(files):
+		flags = result['flags'][i]
+		flagged += bool(flags)
+		if not flags and not args.all:
+			continue
+		low, high = result['total_efficiency'][i] * 100
+		print(f"{filename}: total efficiency {low:.3f} to {high:.3f}% ({percent})")
+		for coil in range(velocities.shape[1]):
+			if result['missing'][i, coil]:
+				continue
+			v_low, v_high = result['velocity'][i, coil]
+			eta_low, eta_high = result['efficiency'][i, coil] * 100
+			print(f"  coil {coil + 1}: {v_low:.2f} to {v_high:.2f} m/s, efficiency {eta_low:.3f} to {eta_high:.3f}%")
+		for flag in flags:
+			print(f"  IMPOSSIBLE: {flag}")
+
+	print(f"{flagged} of {len(files)} shots are impossible. {len(files)} shots with {args.samples} samples took {elapsed:.2f} s")
+
+
+if __name__ == '__main__':
+	main()
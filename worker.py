@@ -0,0 +1,304 @@
+"""
+Real-time I/O worker. A dedicated process owns the Arduinos and the Coilgun
+and runs the charge/fire/drain state machine. The interactive CLI only sends
+commands and receives results over a pipe, so console output, input() and
+pandas never run inside the charge loop or the fire window
+"""
+from communication import Arduino
+from coilgun import Coil, Coilgun
+from fire_window import FireWindow
+from log_queue import DroppingQueueHandler, ForwardingQueueHandler, BlockingStopQueueListener
+from rig import load_rig
+import config
+import multiprocessing
+import numpy as np
+import logging
+import signal
+import queue
+import time
+import gc
+import os
+
+
+class WorkerError(Exception):
+	pass
+
+
+class CoilgunWorker:
+	"""Charge/fire/drain state machine running in the worker process"""
+
+	# States
+	IDLE = "idle"
+	CHARGING = "charging"
+	CHARGED = "charged"
+
+	# Commands (CLI -> worker)
+	CHARGE = "charge" 			# Start charging to a voltage
+	STOP_CHARGE = "stop_charge" 	# Stop charging and get ready to fire
+	FIRE = "fire" 				# Countdown, fire and drain
+	DRAIN_ALL = "drain_all" 		# Drain all CBs
+	FIRE_EMPTY = "fire_empty" 	# Fire only to empty the CBs
+	OFF = "off" 					# Turn off the coilgun
+	SHUTDOWN = "shutdown" 		# Shut down the coilgun and stop the worker
+
+	# Messages (worker -> CLI)
+	READY = "ready" 				# Worker is connected. Carries the rig
+	DONE = "done" 				# A command is finished
+	ERROR = "error" 				# A command failed. Carries the error message
+	VOLTAGES = "voltages" 		# Voltages and charge percent while charging
+	COUNTDOWN = "countdown" 		# Seconds left before firing
+	SHOT = "shot" 				# Result of a shot
+	DRAINED = "drained" 			# Voltages after draining
+
+	def __init__(self, conn, coilgun: Coilgun, period: float):
+		self.conn = conn
+		self.coilgun = coilgun
+		self.logger = coilgun.logger
+		self.fire_window = FireWindow(coilgun)
+		# Time between voltage readings while charging [s]
+		self.period = period
+
+		self.state = CoilgunWorker.IDLE
+		self.max_voltage = None
+		self.charged = False
+
+	def run(self):
+		"""Handle commands until shutdown"""
+		next_tick = time.perf_counter()
+		while True:
+			if self.state == CoilgunWorker.CHARGING:
+				# Fixed rate loop. Wait for commands until the next tick
+				timeout = next_tick - time.perf_counter()
+				if timeout <= 0 or not self.conn.poll(timeout):
+					self._guarded(self._charge_step)
+					next_tick = max(next_tick + self.period, time.perf_counter())
+					continue
+			else:
+				self.conn.poll(None)
+				next_tick = time.perf_counter()
+
+			command, *args = self.conn.recv()
+			if command == CoilgunWorker.SHUTDOWN:
+				self._guarded(self.coilgun.shutdown)
+				self.conn.send((CoilgunWorker.DONE, command))
+				return
+			if self._guarded(self._handle, command, *args):
+				self.conn.send((CoilgunWorker.DONE, command))
+
+	def _guarded(self, func, *args) -> bool:
+		"""Run func and report any error to the CLI. Return True if it succeeded"""
+		try:
+			func(*args)
+			return True
+		except Exception as e:
+			self.logger.exception("Worker command failed")
+			self._set_state(CoilgunWorker.IDLE)
+			self.conn.send((CoilgunWorker.ERROR, f"{type(e).__name__}: {e}"))
+			return False
+
+	def _set_state(self, state: str):
+		"""Change state. The garbage collector only runs while the coilgun is idle"""
+		if state == self.state:
+			return
+		if state == CoilgunWorker.IDLE:
+			gc.enable()
+			gc.collect()
+		else:
+			gc.disable()
+		self.state = state
+
+	def _handle(self, command: str, *args):
+		if command == CoilgunWorker.CHARGE:
+			self.max_voltage = float(args[0])
+			self.charged = False
+			self.coilgun.ON()
+			self._set_state(CoilgunWorker.CHARGING)
+		elif command == CoilgunWorker.STOP_CHARGE:
+			self.coilgun.ABORT()
+			self._set_state(CoilgunWorker.CHARGED)
+		elif command == CoilgunWorker.FIRE:
+			self._set_state(CoilgunWorker.CHARGED)
+			self._fire()
+			self._set_state(CoilgunWorker.IDLE)
+		elif command == CoilgunWorker.DRAIN_ALL:
+			self.coilgun.DRAIN_ALL(True)
+		elif command == CoilgunWorker.FIRE_EMPTY:
+			self.coilgun.FIRE()
+		elif command == CoilgunWorker.OFF:
+			self.coilgun.OFF()
+			self._set_state(CoilgunWorker.IDLE)
+		else:
+			raise WorkerError(f"Unknown command '{command}'")
+
+	def _charge_step(self):
+		"""Read the voltages once and update the charge display"""
+		voltages = np.array(self.coilgun.READ_VOLTAGES())
+		percent = float(np.amax(voltages / self.max_voltage))
+		if percent >= 1:
+			if not self.charged:
+				self.charged = True
+				self.coilgun.BLINK()
+			percent = 1.0
+		self.coilgun.DISPLAY_CHARGE(percent)
+		self.conn.send((CoilgunWorker.VOLTAGES, voltages, percent))
+
+	def _fire(self):
+		"""Countdown, fire and drain all CBs that are safe to drain"""
+		coilgun = self.coilgun
+
+		coilgun.START_COUNTDOWN()
+		for i in range(3):
+			time.sleep(1)
+			self.conn.send((CoilgunWorker.COUNTDOWN, 3 - i))
+		time.sleep(1)
+
+		shot = self.fire_window.fire()
+		self.conn.send((CoilgunWorker.COUNTDOWN, 0))
+		self.conn.send((CoilgunWorker.SHOT, shot))
+
+		time.sleep(1)
+		after_fire_voltages = np.array(coilgun.READ_VOLTAGES())
+
+		# Drain all CBs that are safe to drain
+		coilgun.DRAIN_CB(after_fire_voltages < coilgun.MAX_VOLTAGE_FOR_SAFE_DRAIN)
+
+		time.sleep(1)
+		self.conn.send((CoilgunWorker.DRAINED, np.array(coilgun.READ_VOLTAGES())))
+
+
+def run_worker(conn, log_queue, rig_file: str, period: float):
+	"""Entry point of the worker process"""
+	# Ctrl+C is for the CLI. The worker is stopped with commands
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	logger = logging.getLogger('Coilgun')
+	logger.setLevel(logging.DEBUG)
+	# Records are dropped from a local queue. A thread forwards them to the CLI process
+	local_queue = queue.Queue(config.log_queue_size)
+	log_handler = DroppingQueueHandler(local_queue, config.log_drop_policy)
+	log_forwarder = BlockingStopQueueListener(local_queue, ForwardingQueueHandler(log_queue))
+	log_forwarder.start()
+	logger.addHandler(log_handler)
+
+	try:
+		_run_coilgun(conn, logger, rig_file, period)
+	finally:
+		logger.removeHandler(log_handler)
+		log_forwarder.stop()
+		if log_handler.dropped:
+			log_queue.put(logger.makeRecord(
+				logger.name, logging.WARNING, __file__, 0,
+				"%d log records were dropped because the log queue was full", (log_handler.dropped,), None
+			))
+
+
+def _run_coilgun(conn, logger: logging.Logger, rig_file: str, period: float):
+	"""Connect to the Arduinos and run the state machine until shutdown"""
+	try:
+		# Ask for a higher priority. Only works with the right permissions
+		os.nice(config.worker_nice)
+	except (OSError, AttributeError):
+		logger.debug("Could not change the priority of the worker")
+
+	rig = load_rig(rig_file)
+	arduinos = [Arduino(port, rig.baudrate, rig.timeout) for port, _ in rig.controllers]
+	for arduino in arduinos:
+		if not arduino.connect():
+			conn.send((CoilgunWorker.ERROR, f"Failed to connect to the Arduino on {arduino.port}"))
+			return
+
+	coils = [Coil.from_dict(coil_dict) for coil_dict in rig.coils]
+
+	telemetry = None
+	if config.telemetry_bus_name is not None:
+		from telemetry_bus import TelemetryPublisher, TelemetryBusError
+		try:
+			telemetry = TelemetryPublisher(config.telemetry_bus_name, len(coils), config.telemetry_bus_capacity)
+		except TelemetryBusError as e:
+			conn.send((CoilgunWorker.ERROR, str(e)))
+			return
+
+	coilgun = Coilgun(
+		coils, arduinos, rig.projectile_diameter, rig.projectile_mass,
+		logger=logger, telemetry=telemetry, controller_coils=[n for _, n in rig.controllers]
+	)
+
+	# Everything allocated so far lives for the whole session. Keep it out of future collections
+	gc.collect()
+	gc.freeze()
+
+	conn.send((CoilgunWorker.READY, rig))
+	try:
+		CoilgunWorker(conn, coilgun, period).run()
+	finally:
+		if telemetry is not None:
+			telemetry.close()
+
+
+class WorkerClient:
+	"""CLI side of the worker"""
+
+	def __init__(self, log_queue, rig_file: str, period: float = 0.1):
+		self.conn, self._worker_conn = multiprocessing.Pipe()
+		self.process = multiprocessing.Process(
+			target=run_worker,
+			args=(self._worker_conn, log_queue, rig_file, period),
+			name="coilgun-worker",
+			daemon=True
+		)
+		self.rig = None
+
+	def start(self):
+		"""Start the worker and wait until it has connected to the Arduinos"""
+		self.process.start()
+		# Only the worker should hold its end so the pipe closes if the worker dies
+		self._worker_conn.close()
+		message = None
+		while message is None:
+			message = self.recv(timeout=1)
+		kind, data = message
+		if kind == CoilgunWorker.ERROR:
+			raise WorkerError(data)
+		self.rig = data
+
+	def send(self, command: str, *args):
+		self.conn.send((command, *args))
+
+	def recv(self, timeout: float = None):
+		"""Get the next message from the worker. Return None on timeout"""
+		if not self.conn.poll(timeout):
+			if not self.process.is_alive():
+				raise WorkerError("The worker has stopped")
+			return None
+		try:
+			return self.conn.recv()
+		except EOFError:
+			raise WorkerError("The worker has stopped")
+
+	def request(self, command: str, *args, on_message=None):
+		"""
+		Send a command and wait until it is done.
+		All messages before that are passed to on_message
+		"""
+		self.send(command, *args)
+		while True:
+			message = self.recv(timeout=1)
+			if message is None:
+				continue
+			if message[0] == CoilgunWorker.DONE and message[1] == command:
+				return
+			if message[0] == CoilgunWorker.ERROR:
+				raise WorkerError(message[1])
+			if on_message is not None:
+				on_message(message)
+
+	def stop(self, timeout: float = 10):
+		"""Shut down the coilgun and stop the worker"""
+		if self.process.is_alive():
+			try:
+				self.request(CoilgunWorker.SHUTDOWN)
+			except WorkerError as e:
+				print(e)
+			self.process.join(timeout)
+		if self.process.is_alive():
+			self.process.terminate()